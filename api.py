@@ -0,0 +1,96 @@
+"""API JSON in sola lettura del programma pubblicato, sotto /api/v1.
+
+Le risposte portano ETag e Cache-Control public: un proxy o una CDN possono
+assorbire il polling di app e schermi dei palchi, rivalidando con If-None-Match.
+"""
+import json
+
+from flask import Blueprint, Response, abort, jsonify, request, stream_with_context, url_for
+
+import performances_dao
+import stages_dao
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+# Secondi per cui un client o una cache condivisa possono riusare la risposta senza rivalidarla
+API_MAX_AGE = 30
+
+
+def _cacheable(response, etag):
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = API_MAX_AGE
+    return response
+
+
+def _not_modified(etag):
+    """304 se il client ha già questa versione, altrimenti None."""
+    if request.if_none_match.contains_weak(etag):
+        return _cacheable(Response(status=304), etag)
+    return None
+
+
+def _performance_json(performance):
+    data = dict(performance)
+    data['url'] = url_for('performance_detail', id=performance['id'], _external=True)
+    if performance['performance_image']:
+        data['image_url'] = url_for('static', filename='uploads/' + performance['performance_image'],
+                                    _external=True)
+    else:
+        data['image_url'] = None
+    del data['performance_image']
+    return data
+
+
+@api.route('/performances')
+def performances():
+    """Programma pubblicato, con i filtri day (data ISO o nome del giorno), stage e genre."""
+    etag = performances_dao.schedule_etag(request.full_path)
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+
+    rows = performances_dao.iter_published_performances(request.args.get('day', ''),
+                                                        request.args.get('stage', ''),
+                                                        request.args.get('genre', ''))
+
+    def generate():
+        # Una riga alla volta: la risposta non viene mai costruita per intero in memoria
+        yield '{"performances": ['
+        for i, performance in enumerate(rows):
+            yield (',' if i else '') + json.dumps(_performance_json(performance), ensure_ascii=False)
+        yield ']}'
+
+    response = Response(stream_with_context(generate()), mimetype='application/json')
+    return _cacheable(response, etag)
+
+
+@api.route('/performances/<int:id>')
+def performance(id):
+    etag = performances_dao.schedule_etag(request.full_path)
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+
+    performance = performances_dao.get_published_performance(id)
+    if not performance:
+        abort(404)
+
+    return _cacheable(jsonify(_performance_json(performance)), etag)
+
+
+@api.route('/stages')
+def stages():
+    # I palchi non cambiano durante il processo: ETag dal contenuto
+    response = jsonify({'stages': [{'id': stage['id'], 'name': stage['name'],
+                                    'capacity': stage['capacity'], 'description': stage['description']}
+                                   for stage in stages_dao.get_all_stages()]})
+    response.cache_control.public = True
+    response.cache_control.max_age = API_MAX_AGE
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+@api.errorhandler(404)
+def not_found(error):
+    return jsonify({'error': 'not found'}), 404
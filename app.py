@@ -1,4 +1,10 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, abort
+import os
+import secrets
+from functools import wraps
+
+import click
+from flask import (Flask, Response, render_template, request, redirect, url_for, flash, abort, make_response,
+                   session, stream_with_context, g)
 from datetime import date, datetime
 from flask_login import (
     LoginManager,
@@ -7,17 +13,27 @@ from flask_login import (
     logout_user,
     current_user,
 )
+from markupsafe import Markup
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.security import generate_password_hash, check_password_hash
-from PIL import Image
 
+from api import api
+import database
+import image_pipeline
+import metrics
+import static_assets
+import throttle
 import performances_dao, users_dao, tickets_dao
 from models import User
 import stages_dao
+import schedule_export
+from cache import FragmentCache, LRUCache
 
 # Configurazione applicazione
 PERFORMANCE_IMG_WIDTH = 400
 UPLOAD_FOLDER = 'static/uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024  # 10 MB per richiesta
 
 # Dati festival
 FESTIVAL_NAME = "Madness Festival"
@@ -33,6 +49,44 @@ GENRES = ["Rock", "Pop", "Jazz", "Electronic", "Folk", "Hip-Hop", "Classical", "
 app = Flask(__name__)
 app.config["SECRET_KEY"] = "MadnessFestival2025SecretKey"
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Corpi più grandi vengono rifiutati con 413 prima di essere letti
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_SIZE
+app.config['DATABASE'] = 'db/festival.db'
+app.config['DATABASE_POOL_SIZE'] = 8
+
+app.config['RAW_UPLOAD_FOLDER'] = 'uploads_raw'
+app.config['IMAGE_WORKERS'] = 2
+# Hash di password calcolati in parallelo; oltre si risponde 429
+app.config['HASH_CONCURRENCY'] = 4
+# /metrics risponde 404 finché non si imposta un token (header Authorization: Bearer <token>)
+# o non lo si rende esplicitamente pubblico, es. se raggiungibile solo dalla rete interna
+app.config['METRICS_TOKEN'] = None
+app.config['METRICS_PUBLIC'] = False
+# Proxy inversi davanti all'app che aggiungono X-Forwarded-For (su pythonanywhere: 1).
+# Con 0 l'IP del client, usato dai limiti di login, è l'indirizzo della connessione
+app.config['TRUSTED_PROXY_COUNT'] = 0
+# Identificativo del deploy negli ETag (es. hash del commit). Se None si usa l'hash di
+# codice, template e file statici: uguale in tutti i worker e tra i riavvii
+app.config['ETAG_SALT'] = None
+
+if app.config['TRUSTED_PROXY_COUNT']:
+    # request.remote_addr diventa l'IP aggiunto dal proxy più esterno tra quelli fidati
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXY_COUNT'])
+
+# Pool di connessioni SQLite condiviso da tutti i DAO
+database.init_app(app)
+# Worker per l'elaborazione delle immagini caricate
+image_pipeline.init_app(app)
+# URL statici con fingerprint, cache a lungo termine e varianti precompresse
+static_assets.init_app(app)
+# ETag del programma condivisi tra worker: versione in tabella, sale dal deploy
+performances_dao.set_etag_salt(app.config['ETAG_SALT'] or static_assets.deploy_fingerprint(app))
+# API JSON in sola lettura del programma (/api/v1)
+app.register_blueprint(api)
+# Limiti ai tentativi di login/registrazione e agli hash concorrenti
+throttle.init_app(app)
+# Istogrammi di latenza per endpoint e per query SQL (/metrics)
+metrics.init_app(app)
 
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -45,6 +99,43 @@ DATE_TO_DAY = {
     '2025-07-14': 'domenica'    
 }
 
+def conditional_page(view):
+    """ETag forte da versione del programma, utente e URL: con If-None-Match
+    corrispondente risponde 304 senza eseguire la view (niente DAO, niente Jinja).
+    
+    Versione in tabella e sale del deploy: lo stesso ETag vale in ogni worker e dopo
+    un riavvio, finché non cambiano programma o codice distribuito."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        # Messaggi flash in sessione o template ricaricati al volo: pagina non riutilizzabile
+        if app.debug or session.get('_flashes'):
+            return view(*args, **kwargs)
+        
+        # Anonimi e utenti autenticati (per id e ruolo) non condividono mai un ETag
+        if current_user.is_authenticated:
+            viewer = f"{current_user.id}:{current_user.user_type}"
+        else:
+            viewer = "anon"
+        etag = performances_dao.schedule_etag(viewer, request.full_path)
+        
+        # If-None-Match usa il confronto debole (RFC 9110)
+        if request.if_none_match.contains_weak(etag):
+            response = app.response_class(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            # La view può escludere la pagina se cambia senza cambiare la versione del programma
+            if response.status_code != 200 or g.get('skip_etag'):
+                return response
+        
+        response.set_etag(etag)
+        # Sempre rivalidata; le pagine di un utente autenticato non vanno in cache condivise
+        response.cache_control.no_cache = True
+        if current_user.is_authenticated:
+            response.cache_control.private = True
+        response.vary.add('Cookie')
+        return response
+    return wrapper
+
 def require_participant():
     """Verifica se l'utente corrente è un partecipante autorizzato"""
     if not current_user.is_authenticated or current_user.user_type != 'participant':
@@ -62,63 +153,193 @@ def require_organizer():
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def save_image(file, prefix):
-    """Salva l'immagine ridimensionandola e tagliandola a 450x450 (crop centrale)."""
+def save_image(file):
+    """Salva l'immagine caricata senza elaborarla: il crop 450x450 in WebP avviene nel worker.
+    Il nome deriva dall'hash del contenuto. Restituisce (nome_file_finale, percorso_grezzo, errore)."""
     if file and allowed_file(file.filename):
-        from PIL import Image
-        import os
-        filename = file.filename
-        timestamp = int(datetime.now().timestamp())
-        new_filename = f"{prefix}_{timestamp}.webp"
-        img = Image.open(file).convert("RGB")
-
-        # Crop centrale
-        target_width = 450
-        target_height = 450
-        aspect_ratio = target_width / target_height
-        img_ratio = img.width / img.height
-
-        # Crop per mantenere proporzione
-        if img_ratio > aspect_ratio:
-            # Immagine troppo larga
-            new_width = int(img.height * aspect_ratio)
-            left = (img.width - new_width) // 2
-            img = img.crop((left, 0, left + new_width, img.height))
-        else:
-            # Immagine troppo alta
-            new_height = int(img.width / aspect_ratio)
-            top = (img.height - new_height) // 2
-            img = img.crop((0, top, img.width, top + new_height))
-
-        # Resize finale
-        img = img.resize((target_width, target_height), Image.Resampling.LANCZOS)
-
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], new_filename)
-        img.save(filepath, "WebP", quality=40, optimize=True)
-        return new_filename, None
-
-    return None, "File non valido"
+        return image_pipeline.store_raw(file)
+
+    return None, None, "File non valido"
+
+@app.errorhandler(throttle.Throttled)
+def too_many_requests(error):
+    """429 con Retry-After: la richiesta viene scartata invece di attendere in coda."""
+    response = make_response(render_template("too_many_requests.html", retry_after=error.retry_after), 429)
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+@app.errorhandler(413)
+def request_too_large(error):
+    flash(f"File troppo grande: il limite è {MAX_UPLOAD_SIZE // (1024 * 1024)} MB", "danger")
+    return redirect(request.referrer or url_for("home"))
+
+@app.template_global()
+def image_srcset(performance):
+    """srcset con le derivate generate; stringa vuota senza derivate (i template usano solo src)."""
+    image = performance['performance_image']
+    return ', '.join(
+        f"{url_for('static', filename='uploads/' + image_pipeline.variant_filename(image, width))} {width}w"
+        for width in image_pipeline.parse_variants(performance['image_variants']))
+
+# HTML delle card della home, chiave (id performance, versione del programma, riga)
+_card_cache = FragmentCache(maxsize=512)
+
+@app.template_global()
+def performance_card(performance):
+    """Card della home dalla cache dei frammenti: ogni modifica al programma cambia versione."""
+    # La versione è in tabella: una lettura per richiesta, non una per card
+    if 'schedule_version' not in g:
+        g.schedule_version = performances_dao.get_schedule_version()
+    # L'hash della riga evita di salvare sotto la nuova versione dati letti con la precedente
+    key = (performance['id'], g.schedule_version, hash(tuple(performance)))
+    template = app.jinja_env.get_template("performance_card.html")
+    return _card_cache.get_or_render(key, lambda: Markup(template.render(performance=performance)))
+
+def get_card_cache_stats():
+    """Hit ratio e tempo di rendering risparmiato dalla cache delle card."""
+    return _card_cache.stats()
 
 @app.route("/")
+@conditional_page
 def home():
     """Pagina principale con elenco performance filtrabili"""
     day_filter = request.args.get('day', '')
     stage_filter = request.args.get('stage', '')
     genre_filter = request.args.get('genre', '')
     
-    performances = performances_dao.get_published_performances(day_filter, stage_filter, genre_filter)
+    # Paginazione keyset: i cursori arrivano come parametri after/before
+    page = performances_dao.get_published_performances(day_filter, stage_filter, genre_filter,
+                                                       after=request.args.get('after'),
+                                                       before=request.args.get('before'))
     
     # Carica palchi solo se non si sta filtrando
     stages = stages_dao.get_all_stages() if not stage_filter else []
     
+    return render_template("home.html", 
+                         performances=page['performances'],
+                         next_cursor=page['next_cursor'],
+                         prev_cursor=page['prev_cursor'],
+                         genres=GENRES,
+                         stages=stages,
+                         festival_name=FESTIVAL_NAME,
+                         festival_location=FESTIVAL_LOCATION)
+
+# Export completati, chiave (versione del programma, host, formato, giorno, palco)
+_export_cache = LRUCache(maxsize=32)
+
+def export_response(kind, mimetype, filename, render):
+    """Export del programma: 304 se il client ha già questa versione, copia in cache se
+    già generata, altrimenti streaming riga per riga salvando il documento completo."""
+    day = request.args.get('day', '')
+    stage = request.args.get('stage', '')
+    # I documenti contengono URL assoluti costruiti dall'header Host: un Host diverso
+    # non deve mai ricevere la copia generata per un altro
+    key = (performances_dao.get_schedule_version(), request.host_url, kind, day, stage)
+    etag = performances_dao.schedule_etag(*key[1:], version=key[0])
+    
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        document = _export_cache.get(key)
+        if document is None:
+            rows = performances_dao.iter_schedule_export(day, stage)
+            
+            def generate():
+                chunks = []
+                for chunk in render(rows):
+                    chunks.append(chunk)
+                    yield chunk
+                # Solo documenti completi: uno stream interrotto non finisce in cache
+                _export_cache.set(key, ''.join(chunks))
+            
+            document = stream_with_context(generate())
+        response = Response(document, mimetype=mimetype)
+        response.headers['Content-Disposition'] = f'inline; filename="{filename}"'
+    
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response
+
+@app.route("/schedule.ics")
+def schedule_ics():
+    """Programma pubblicato in formato iCalendar, filtrabile per day e stage."""
+    return export_response('ics', 'text/calendar', 'madness-festival.ics',
+                           lambda rows: schedule_export.iter_ics(rows, FESTIVAL_LOCATION))
+
+@app.route("/schedule.csv")
+def schedule_csv():
+    """Programma pubblicato in formato CSV, filtrabile per day e stage."""
+    return export_response('csv', 'text/csv', 'madness-festival.csv', schedule_export.iter_csv)
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Metriche Prometheus: latenze di richieste e query, cache, coda immagini e limiti."""
+    token = app.config['METRICS_TOKEN']
+    if token:
+        authorization = request.headers.get('Authorization', '')
+        if not secrets.compare_digest(authorization.encode(), f"Bearer {token}".encode()):
+            abort(403)
+    elif not app.config['METRICS_PUBLIC']:
+        abort(404)
+    
+    caches = {
+        'schedule': performances_dao.get_schedule_cache_stats(),
+        'stages': stages_dao.get_stages_cache_stats(),
+        'session_users': users_dao.get_user_cache_stats(),
+        'cards': get_card_cache_stats(),
+        'exports': _export_cache.stats(),
+    }
+    images = image_pipeline.get_stats()
+    rejections = throttle.get_stats()
+    
+    families = [
+        ('festival_cache_hits_total', 'counter', 'Letture servite dalla cache.',
+         [({'cache': name}, stats['hits']) for name, stats in caches.items()]),
+        ('festival_cache_misses_total', 'counter', 'Letture non trovate in cache.',
+         [({'cache': name}, stats['misses']) for name, stats in caches.items()]),
+        ('festival_cache_entries', 'gauge', 'Voci presenti in cache.',
+         [({'cache': name}, stats['size']) for name, stats in caches.items()]),
+        ('festival_card_render_seconds_total', 'counter', 'Tempo speso a renderizzare le card della home.',
+         [({}, caches['cards']['render_seconds'])]),
+        ('festival_schedule_version', 'gauge', 'Versione del programma pubblicato.',
+         [({}, performances_dao.get_schedule_version())]),
+        ('festival_schedule_index_slots', 'gauge', "Slot pubblicati nell'indice dei conflitti.",
+         [({}, performances_dao.get_schedule_index_stats()['slots'])]),
+        ('festival_image_jobs', 'gauge', 'Elaborazioni di immagini in coda o in corso.',
+         [({}, images['pending_jobs'])]),
+        ('festival_throttle_rejections_total', 'counter', 'Richieste rifiutate con 429, per motivo.',
+         [({'reason': reason}, count) for reason, count in rejections.items()]),
+    ]
+    
+    return Response(metrics.render(families), mimetype='text/plain; version=0.0.4')
+
+@app.route("/search")
+def search():
+    """Ricerca full-text per artista o descrizione, combinabile con i filtri"""
+    search_query = request.args.get('q', '').strip()
+    day_filter = request.args.get('day', '')
+    stage_filter = request.args.get('stage', '')
+    genre_filter = request.args.get('genre', '')
+    
+    # Senza testo la ricerca coincide con l'elenco filtrato della homepage
+    if not search_query:
+        return redirect(url_for("home", day=day_filter, stage=stage_filter, genre=genre_filter))
+    
+    performances = performances_dao.search_performances(search_query, day_filter, stage_filter, genre_filter)
+    
+    stages = stages_dao.get_all_stages() if not stage_filter else []
+    
     return render_template("home.html", 
                          performances=performances,
+                         search_query=search_query,
                          genres=GENRES,
                          stages=stages,
                          festival_name=FESTIVAL_NAME,
                          festival_location=FESTIVAL_LOCATION)
 
 @app.route("/performance/<int:id>")
+@conditional_page
 def performance_detail(id):
     """Pagina dettaglio performance individuale"""
     performance = performances_dao.get_performance(id)
@@ -126,6 +347,11 @@ def performance_detail(id):
                           (not current_user.is_authenticated or current_user.user_type != 'organizer')):
         abort(404)
     
+    # Bozza: cambia anche al termine dell'elaborazione dell'immagine, che non incrementa
+    # la versione del programma (riservata alle modifiche di quanto è pubblicato)
+    if not performance['published']:
+        g.skip_etag = True
+    
     return render_template("performance_detail.html",
                            performance=performance,
                            festival_name=FESTIVAL_NAME,
@@ -150,6 +376,8 @@ def register_post():
         flash("Tipo utente non valido", "danger")
         return redirect(url_for("register"))
     
+    throttle.check('register_ip', request.remote_addr)
+    
     # Verifica utente esistente
     existing_user = users_dao.get_user_by_email(form_data['email'])
     if existing_user:
@@ -157,7 +385,8 @@ def register_post():
         return redirect(url_for("register"))
     
     # Hash password prima del salvataggio
-    form_data['password'] = generate_password_hash(form_data['password'])
+    with throttle.hash_slot():
+        form_data['password'] = generate_password_hash(form_data['password'])
     
     success = users_dao.add_user(form_data)
     
@@ -174,9 +403,20 @@ def login():
     email = request.form.get('email')
     password = request.form.get('password')
     
+    # Limiti per IP e per account prima di qualsiasi hash
+    throttle.check('login_ip', request.remote_addr)
+    throttle.check('login_email', (email or '').strip().lower())
+    
     user_db = users_dao.get_user_by_email(email)
     
-    if not user_db or not check_password_hash(user_db['password'], password):
+    if not user_db:
+        flash("Credenziali non valide", "danger")
+        return redirect(url_for("home"))
+    
+    with throttle.hash_slot():
+        valid = check_password_hash(user_db['password'], password)
+    
+    if not valid:
         flash("Credenziali non valide", "danger")
         return redirect(url_for("home"))
     
@@ -209,11 +449,15 @@ def profile():
         return render_template("profile_participant.html", tickets=tickets)
     
     elif current_user.user_type == 'organizer':
-        performances = performances_dao.get_organizer_performances(current_user.id)
+        page = performances_dao.get_organizer_performances(current_user.id,
+                                                           after=request.args.get('after'),
+                                                           before=request.args.get('before'))
         stats = tickets_dao.get_festival_stats()
         
         return render_template("profile_organizer.html", 
-                             performances=performances, 
+                             performances=page['performances'], 
+                             next_cursor=page['next_cursor'],
+                             prev_cursor=page['prev_cursor'],
                              stats=stats)
     else:
         flash("Tipo di utente non riconosciuto", "danger")
@@ -226,11 +470,9 @@ def buy_ticket():
     auth_check = require_participant()
     if auth_check: return auth_check
     
-    # Ottieni stato corrente
-    availability = tickets_dao.get_daily_availability()
-    covered_days = tickets_dao.get_user_covered_days(current_user.id)
-    existing_tickets = tickets_dao.get_user_tickets(current_user.id)
-    has_multi_day = any(ticket['ticket_type'] in ['2days', 'full'] for ticket in existing_tickets)
+    # Ottieni stato corrente (disponibilità, giorni coperti, biglietti) in una sola query
+    context = tickets_dao.get_purchase_context(current_user.id)
+    disabled_types = context['disabled_types']
     
     # Definisci opzioni biglietti con logica di business
     ticket_types = [
@@ -240,7 +482,7 @@ def buy_ticket():
             'title': 'Biglietto Giornaliero',
             'description': 'Valido per un solo giorno',
             'price': TICKET_PRICES['daily'],
-            'disabled': has_multi_day,
+            'disabled': disabled_types['daily'],
             'disabled_reason': 'Hai già un pass multi-giorno'
         },
         {
@@ -250,7 +492,7 @@ def buy_ticket():
             'description': 'Valido per due giorni consecutivi',
             'price': 90,
             'discount': 10,
-            'disabled': existing_tickets,
+            'disabled': disabled_types['2days'],
             'disabled_reason': 'Hai già altri biglietti'
         },
         {
@@ -260,7 +502,7 @@ def buy_ticket():
             'description': 'Valido per tutti e tre i giorni', 
             'price': 130,
             'discount': 20,
-            'disabled': existing_tickets,
+            'disabled': disabled_types['full'],
             'disabled_reason': 'Hai già altri biglietti'
         }
     ]
@@ -288,10 +530,10 @@ def buy_ticket():
     ]
     
     return render_template("buy_ticket.html", 
-                         availability=availability,
-                         covered_days=covered_days,
-                         existing_tickets=existing_tickets,
-                         has_multi_day=has_multi_day,
+                         availability=context['availability'],
+                         covered_days=context['covered_days'],
+                         existing_tickets=context['existing_tickets'],
+                         has_multi_day=context['has_multi_day'],
                          ticket_types=ticket_types,      
                          festival_days=festival_days)
 
@@ -325,18 +567,6 @@ def buy_ticket_post():
         flash("Devi selezionare un tipo di biglietto", "danger")
         return redirect(url_for("buy_ticket"))
     
-    # Verifica disponibilità e regole di acquisto
-    availability_result = tickets_dao.check_availability(ticket_type, selected_days)
-    if not availability_result:
-        flash("Biglietti non disponibili per le date selezionate", "danger")
-        return redirect(url_for("buy_ticket"))
-    
-    can_purchase, message = tickets_dao.can_purchase_ticket(current_user.id, ticket_type, selected_days)
-    
-    if not can_purchase:
-        flash(message, "danger")
-        return redirect(url_for("buy_ticket"))
-    
     # Elabora giorni per salvataggio database
     if ticket_type == 'full':
         days_string = 'venerdi,sabato,domenica'
@@ -359,13 +589,19 @@ def buy_ticket_post():
         'purchase_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     }
     
-    success = tickets_dao.add_ticket(ticket_data)
+    # Prevalidazione sullo stesso contesto della pagina: evita il lock per richieste impossibili
+    context = tickets_dao.get_purchase_context(current_user.id)
+    outcome, message = tickets_dao.check_purchase_context(context, ticket_type, selected_days)
     
-    if success:
+    # Disponibilità, regole di acquisto e inserimento in un'unica transazione
+    if outcome == tickets_dao.PURCHASE_SUCCESS:
+        outcome, message = tickets_dao.purchase_ticket(ticket_data)
+    
+    if outcome == tickets_dao.PURCHASE_SUCCESS:
         flash("Biglietto acquistato con successo!", "success")
         return redirect(url_for("profile"))
     else:
-        flash("Errore durante l'acquisto del biglietto", "danger")
+        flash(message, "danger")
         return redirect(url_for("buy_ticket"))
 
 @app.route("/new_performance")
@@ -423,28 +659,27 @@ def new_performance_post():
         flash("L'immagine promozionale è obbligatoria", "danger")
         return redirect(url_for("new_performance"))
     
-    result = save_image(performance_image, f"perf_{form_data['artist_name']}")
-
-    if isinstance(result, tuple):
-        image_filename, error_message = result
-        if error_message:
-            flash(f"Errore immagine: {error_message}", "danger")
-            return redirect(url_for("new_performance"))
-        form_data['performance_image'] = image_filename
-    else:
-        form_data['performance_image'] = result  
+    image_filename, raw_path, error_message = save_image(performance_image)
+    if error_message:
+        flash(f"Errore immagine: {error_message}", "danger")
+        return redirect(url_for("new_performance"))
+    form_data['performance_image'] = image_filename
+    form_data['image_status'] = image_pipeline.IMAGE_STATUS_PENDING
     
     # Imposta campi aggiuntivi
     form_data['organizer_id'] = current_user.id
     form_data['published'] = False  # Bozza per default
     form_data['stage_id'] = stage_id 
     
-    success = performances_dao.add_performance(form_data)
+    performance_id = performances_dao.add_performance(form_data)
     
-    if success:
+    if performance_id:
+        # Elaborazione immagine in background: la risposta non la attende
+        image_pipeline.submit(performance_id, raw_path, image_filename)
         flash("Performance creata con successo!", "success")
         return redirect(url_for("profile"))
     else:
+        os.remove(raw_path)
         flash("Errore durante la creazione della performance", "danger")
         return redirect(url_for ("new_performance"))
 
@@ -501,25 +736,25 @@ def edit_performance_post(id):
     
     # Gestisce upload immagine
     performance_image = request.files.get('performance_image')
+    raw_path = None
     if performance_image:
-        result = save_image(performance_image, f"perf_{form_data['artist_name']}", 
-                       PERFORMANCE_IMG_WIDTH, 
-                       min_height=400,
-                       max_height=800)
-    
-        if isinstance(result, tuple):
-            image_filename, error_message = result
-            if error_message:
-                flash(f"Errore immagine: {error_message}", "danger")
-                return redirect(url_for("edit_performance", id=id))
-            form_data['performance_image'] = image_filename
+        image_filename, raw_path, error_message = save_image(performance_image)
+        if error_message:
+            flash(f"Errore immagine: {error_message}", "danger")
+            return redirect(url_for("edit_performance", id=id))
+        form_data['performance_image'] = image_filename
+        form_data['image_status'] = image_pipeline.IMAGE_STATUS_PENDING
     
     success = performances_dao.update_performance(form_data)
     
     if success:
+        if raw_path:
+            image_pipeline.submit(id, raw_path, form_data['performance_image'])
         flash("Performance aggiornata con successo!", "success")
         return redirect(url_for("profile"))
     else:
+        if raw_path:
+            os.remove(raw_path)
         flash("Errore durante l'aggiornamento", "danger")
         return redirect(url_for("edit_performance", id=id))
 
@@ -540,6 +775,11 @@ def publish_performance_route(performance_id):
         flash(f'Impossibile pubblicare "{performance["artist_name"]}": devi caricare un\'immagine promozionale prima della pubblicazione.', 'warning')
         return redirect(url_for('profile'))
     
+    # ...e l'elaborazione in background deve essere conclusa
+    if performance['image_status'] != image_pipeline.IMAGE_STATUS_READY:
+        flash(f'Impossibile pubblicare "{performance["artist_name"]}": l\'immagine non è ancora pronta (stato: {performance["image_status"]}).', 'warning')
+        return redirect(url_for('profile'))
+    
     if performances_dao.publish_performance(performance_id):  
         flash(f'Performance "{performance["artist_name"]}" pubblicata con successo!', 'success')
     else:
@@ -547,6 +787,44 @@ def publish_performance_route(performance_id):
     
     return redirect(url_for('profile'))
 
+@app.route('/publish_performances', methods=['POST'])
+@login_required
+def publish_performances_route():
+    """Pubblica in blocco le bozze selezionate - una sola transazione, report per performance"""
+    auth_check = require_organizer()
+    if auth_check: return auth_check
+    
+    try:
+        performance_ids = [int(value) for value in request.form.getlist('performance_ids')]
+    except ValueError:
+        abort(400)
+    
+    if not performance_ids:
+        flash('Seleziona almeno una bozza da pubblicare.', 'warning')
+        return redirect(url_for('profile'))
+    
+    report = performances_dao.publish_performances(performance_ids, current_user.id)
+    
+    published = [entry['artist_name'] for entry in report.values() if entry['status'] == 'published']
+    if published:
+        flash(f'Pubblicate {len(published)} performance: {", ".join(published)}', 'success')
+    
+    for entry in report.values():
+        if entry['status'] == 'conflict':
+            flash(f'Impossibile pubblicare "{entry["artist_name"]}": conflitto di orario.', 'error')
+        elif entry['status'] == 'image_not_ready':
+            flash(f'Impossibile pubblicare "{entry["artist_name"]}": l\'immagine non è ancora pronta.', 'warning')
+        elif entry['status'] == 'missing_image':
+            flash(f'Impossibile pubblicare "{entry["artist_name"]}": devi caricare un\'immagine promozionale.', 'warning')
+        elif entry['status'] == 'error':
+            flash('Errore durante la pubblicazione.', 'error')
+    
+    not_found = sum(1 for entry in report.values() if entry['status'] == 'not_found')
+    if not_found:
+        flash(f'{not_found} performance non trovate o non autorizzate.', 'error')
+    
+    return redirect(url_for('profile'))
+
 @app.route("/delete_performance/<int:id>", methods=["POST"])
 @login_required
 def delete_performance_route(id):
@@ -571,19 +849,77 @@ def delete_performance_route(id):
     
     return redirect(url_for("profile"))
 
+@app.cli.command("rebuild-inventory")
+def rebuild_inventory_command():
+    """Rigenera ticket_days e i contatori day_inventory dai biglietti e segnala i disallineamenti."""
+    drift = tickets_dao.rebuild_day_inventory()
+    
+    if not drift:
+        print("Contatori allineati: nessuna differenza trovata")
+        return
+    
+    for day, counts in drift.items():
+        if counts['missing'] or counts['extra']:
+            print(f"{day}: ticket_days con {counts['missing']} righe mancanti e {counts['extra']} "
+                  f"in eccesso rispetto a tickets.days -> rigenerate")
+        if counts['stored'] != counts['actual']:
+            print(f"{day}: salvati {counts['stored']}, effettivi {counts['actual']} -> corretti")
+
+@app.cli.command("process-pending-images")
+def process_pending_images_command():
+    """Rielabora le immagini rimaste in stato 'pending' (es. dopo un riavvio)."""
+    jobs = image_pipeline.requeue_pending()
+    failed = {}
+    for performance_id, future in jobs.items():
+        try:
+            future.result()
+        except Exception as e:
+            failed[performance_id] = e
+    # Attende anche i callback che registrano lo stato finale
+    image_pipeline.shutdown()
+    
+    # Le performance fallite restano con image_status = 'failed', da ricaricare a mano
+    for performance_id, error in failed.items():
+        print(f"Performance {performance_id}: elaborazione fallita ({error}) -> stato 'failed'")
+    print(f"Immagini rielaborate: {len(jobs) - len(failed)}, fallite: {len(failed)}")
+    if failed:
+        raise click.exceptions.Exit(1)
+
+@app.cli.command("generate-image-derivatives")
+def generate_image_derivatives_command():
+    """Genera le derivate srcset per le immagini già presenti in static/uploads."""
+    done, failed = image_pipeline.backfill_derivatives()
+    image_pipeline.shutdown()
+    print(f"Derivate generate: {done}, errori: {failed}")
+
+@app.cli.command("build-assets")
+def build_assets_command():
+    """Genera le varianti gzip/brotli dei CSS e JS in static/."""
+    for filename, size, gz_size, br_size in static_assets.build(app.static_folder):
+        br = f", br {br_size} B" if br_size is not None else ""
+        print(f"{filename}: {size} B -> gz {gz_size} B{br}")
+    if static_assets.brotli is None:
+        print("Modulo brotli non installato: generate solo le varianti gzip")
+
+@app.cli.command("gc-uploads")
+@click.option("--dry-run", is_flag=True, help="Elenca i file senza eliminarli.")
+@click.option("--grace-hours", default=24.0, show_default=True,
+              help="Risparmia i file scritti o sostituiti da meno di queste ore.")
+def gc_uploads_command(dry_run, grace_hours):
+    """Elimina le immagini caricate non più usate da nessuna performance."""
+    report = image_pipeline.collect_orphans(int(grace_hours * 3600), dry_run=dry_run)
+    
+    for path in report['files']:
+        print(f"{'da eliminare' if dry_run else 'eliminato'}: {path}")
+    
+    action = "Recuperabili" if dry_run else "Recuperati"
+    print(f"{action} {report['bytes'] / (1024 * 1024):.1f} MB in {len(report['files'])} file "
+          f"(voci di coda scadute: {report['dequeued']})")
+
 @login_manager.user_loader
 def load_user(user_id):
-    """Callback Flask-Login per ricaricare utente dalla sessione"""
-    db_user = users_dao.get_user_by_id(user_id)
-    if db_user:
-        return User(
-            id=db_user['id'],
-            email=db_user['email'],
-            full_name=db_user['full_name'],
-            user_type=db_user['user_type'],
-            profile_image=db_user['profile_image'] if 'profile_image' in db_user else None
-        )
-    return None
+    """Callback Flask-Login per ricaricare utente dalla sessione (in cache per id)"""
+    return users_dao.get_session_user(user_id)
 
 if __name__ == "__main__":    
     app.run(host="0.0.0.0", port=3000, debug=True)
\ No newline at end of file
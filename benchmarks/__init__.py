@@ -0,0 +1 @@
+"""Script di misura delle prestazioni. Eseguire dalla radice del progetto: python -m benchmarks.<nome>"""
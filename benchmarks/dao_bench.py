@@ -0,0 +1,484 @@
+"""Microbenchmark delle funzioni pubbliche dei DAO, su database di più dimensioni.
+
+Ogni funzione viene chiamata --repeat volte su database generati da
+benchmarks.datagen; per ogni caso si registrano mediana, p95 e media. Le
+funzioni con cache sono misurate a freddo (cache svuotata prima di ogni
+chiamata) e, dove serve, anche a caldo. Le scritture girano dopo le letture,
+su copie usa e getta.
+
+    python -m benchmarks.dao_bench --save-baseline       # registra la baseline
+    python -m benchmarks.dao_bench                       # confronta, exit 1 se regressioni
+
+Una regressione è una mediana oltre baseline * (1 + --threshold) e più lenta di
+almeno --min-delta-us microsecondi, per non segnalare il rumore sui casi da pochi µs.
+La baseline dipende dalla macchina: va registrata e confrontata sullo stesso host.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from werkzeug.security import generate_password_hash
+
+import database
+import performances_dao
+import stages_dao
+import tickets_dao
+import users_dao
+from benchmarks import datagen
+
+SIZES = {
+    'small': dict(participants=500, organizers=5, performances=60, tickets=100, stages=4),
+    'medium': dict(participants=2000, organizers=20, performances=300, tickets=300, stages=12),
+    'large': dict(participants=20000, organizers=100, performances=1000, tickets=450, stages=40),
+}
+DEFAULT_BASELINE = os.path.join('benchmarks', 'baselines', 'dao.json')
+
+# Numero di chiamate: le scritture e il controllo della password costano molto di più
+WRITE_REPEAT = 50
+HASH_REPEAT = 5
+ROUNDS = 5
+
+# before(i) gira fuori dalla misura e restituisce gli argomenti di call;
+# checked: call restituisce False quando l'operazione non è andata a buon fine
+Case = namedtuple('Case', 'name call before repeat checked', defaults=(None, None, False))
+
+
+def _no_args(i):
+    return ()
+
+
+def _clear_schedule_cache(i):
+    performances_dao._schedule_cache.clear()
+    return ()
+
+
+def _clear_stages_cache(i):
+    stages_dao._stages_cache.clear()
+    return ()
+
+
+def _filter_combinations(day, stage, genre):
+    """Le 8 combinazioni di filtri giorno/palco/genere, presenti o assenti."""
+    for use_day in (False, True):
+        for use_stage in (False, True):
+            for use_genre in (False, True):
+                yield (day if use_day else '', stage if use_stage else '', genre if use_genre else '')
+
+
+class Dataset:
+    """Valori di input estratti dal database generato, scelti in modo deterministico."""
+
+    def __init__(self, path, seed):
+        rng = random.Random(seed)
+        conn = sqlite3.connect(path)
+        conn.row_factory = sqlite3.Row
+
+        self.published = [dict(row) for row in conn.execute(
+            'SELECT id, stage_id, day, start_time, duration, artist_name FROM performances WHERE published = 1')]
+        self.organizers = [row[0] for row in conn.execute("SELECT id FROM users WHERE user_type = 'organizer'")]
+        participants = [tuple(row) for row in conn.execute(
+            "SELECT id, email FROM users WHERE user_type = 'participant' ORDER BY id")]
+        with_tickets = {row[0] for row in conn.execute('SELECT user_id FROM tickets')}
+        self.buyers = [p for p in participants if p[0] in with_tickets]
+        self.fresh = [p for p in participants if p[0] not in with_tickets]
+        self.stage = conn.execute('SELECT name FROM stages ORDER BY id').fetchone()[0]
+        self.stage_ids = [row[0] for row in conn.execute('SELECT id FROM stages')]
+
+        # Palco dedicato alle bozze dei benchmark di scrittura: slot da un minuto, mai in conflitto
+        cursor = conn.execute("INSERT INTO stages (name, capacity, description) VALUES ('Bench Stage', 100, '')")
+        self.bench_stage_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+
+        rng.shuffle(self.published)
+        rng.shuffle(self.buyers)
+        self._slot = 0
+        self._users = 0
+
+    def pick(self, items, i):
+        return items[i % len(items)]
+
+    def next_slot(self):
+        """(giorno, ora) libero sul palco dei benchmark."""
+        day = list(datagen.DAY_DATES.values())[self._slot // 1440]
+        start = self._slot % 1440
+        self._slot += 1
+        return day, f"{start // 60:02d}:{start % 60:02d}"
+
+    def draft(self, i):
+        day, start_time = self.next_slot()
+        return {
+            'artist_name': f"Bench Artist {self._slot}",
+            'day': day,
+            'start_time': start_time,
+            'duration': 1,
+            'description': 'Bozza di benchmark',
+            'stage_id': self.bench_stage_id,
+            'genre': datagen.GENRES[i % len(datagen.GENRES)],
+            'performance_image': 'bench.webp',
+            'organizer_id': self.pick(self.organizers, i),
+            'published': 0,
+        }
+
+    def new_user(self):
+        self._users += 1
+        return {'email': f"bench{self._users}@bench.test", 'password': 'x',
+                'full_name': f"Bench {self._users}", 'user_type': 'participant'}
+
+
+def _read_cases(data):
+    performance = data.published[0]
+    buyer_id, buyer_email = data.buyers[0]
+    fresh_id = data.fresh[0][0]
+    day = performance['day']
+    genre = datagen.GENRES[0]
+    second_page = performances_dao.get_published_performances()['next_cursor']
+    slots = [{'id': -i, 'stage_id': data.pick(data.stage_ids, i), 'day': day,
+              'start_time': f"{12 + i:02d}:10", 'duration': 30} for i in range(10)]
+    context = tickets_dao.get_purchase_context(buyer_id)
+
+    def session_user(i):
+        users_dao._user_cache.clear()
+        return (data.pick(data.buyers, i)[0],)
+
+    cases = [
+        Case('performances.get_schedule_version', performances_dao.get_schedule_version),
+        Case('performances.get_schedule_cache_stats', performances_dao.get_schedule_cache_stats),
+        Case('performances.get_schedule_index_stats', performances_dao.get_schedule_index_stats),
+    ]
+    for filters in _filter_combinations(day, data.stage, genre):
+        label = ','.join(name for name, value in zip(('day', 'stage', 'genre'), filters) if value) or 'all'
+        cases.append(Case(f'performances.get_published_performances[{label}]',
+                          performances_dao.get_published_performances,
+                          lambda i, filters=filters: _clear_schedule_cache(i) + filters))
+    cases += [
+        Case('performances.get_published_performances[after]', performances_dao.get_published_performances,
+             lambda i: _clear_schedule_cache(i) + ('', '', '', second_page)),
+        Case('performances.get_published_performances[cached]', performances_dao.get_published_performances),
+        Case('performances.iter_published_performances',
+             lambda: list(performances_dao.iter_published_performances())),
+        Case('performances.iter_schedule_export', lambda: list(performances_dao.iter_schedule_export())),
+        Case('performances.get_published_performance', performances_dao.get_published_performance,
+             lambda i: (data.pick(data.published, i)['id'],)),
+        Case('performances.search_performances', performances_dao.search_performances,
+             lambda i: (datagen.WORDS[i % len(datagen.WORDS)],)),
+        Case('performances.search_performances[day]', performances_dao.search_performances,
+             lambda i: (datagen.WORDS[i % len(datagen.WORDS)], day)),
+        Case('performances.get_performance', performances_dao.get_performance,
+             lambda i: (data.pick(data.published, i)['id'],)),
+        Case('performances.get_organizer_performances', performances_dao.get_organizer_performances,
+             lambda i: (data.pick(data.organizers, i),)),
+        Case('performances.check_conflict', performances_dao.check_conflict,
+             lambda i: (data.pick(data.stage_ids, i), day, f"{12 + i % 12:02d}:{i % 60:02d}", 45)),
+        Case('performances.check_conflict_exclude', performances_dao.check_conflict_exclude,
+             lambda i: (performance['stage_id'], performance['day'], performance['start_time'],
+                        performance['duration'], performance['id'])),
+        Case('performances.validate_schedule', performances_dao.validate_schedule, lambda i: (slots,)),
+        Case('performances.artist_exists', performances_dao.artist_exists,
+             lambda i: (data.pick(data.published, i)['artist_name'],)),
+        Case('performances.get_pending_images', performances_dao.get_pending_images),
+        Case('performances.get_images_without_variants', performances_dao.get_images_without_variants),
+        Case('performances.get_referenced_images', performances_dao.get_referenced_images),
+        Case('performances.get_upload_deletions', performances_dao.get_upload_deletions),
+
+        Case('tickets.get_user_tickets', tickets_dao.get_user_tickets, lambda i: (data.pick(data.buyers, i)[0],)),
+        Case('tickets.get_daily_availability', tickets_dao.get_daily_availability),
+        Case('tickets.check_availability', tickets_dao.check_availability, lambda i: ('daily', ['sabato'])),
+        Case('tickets.can_purchase_ticket[holder]', tickets_dao.can_purchase_ticket,
+             lambda i: (data.pick(data.buyers, i)[0], 'daily', ['domenica'])),
+        Case('tickets.can_purchase_ticket[new]', tickets_dao.can_purchase_ticket,
+             lambda i: (data.pick(data.fresh, i)[0], 'full', datagen.DAYS)),
+        Case('tickets.get_purchase_context', tickets_dao.get_purchase_context,
+             lambda i: (data.pick(data.buyers, i)[0],)),
+        Case('tickets.check_purchase_context', tickets_dao.check_purchase_context,
+             lambda i: (context, 'daily', ['venerdi'])),
+        Case('tickets.get_user_covered_days', tickets_dao.get_user_covered_days,
+             lambda i: (data.pick(data.buyers, i)[0],)),
+        Case('tickets.get_festival_stats', tickets_dao.get_festival_stats),
+
+        Case('users.get_user_cache_stats', users_dao.get_user_cache_stats),
+        Case('users.invalidate_user', users_dao.invalidate_user, lambda i: (fresh_id,)),
+        Case('users.get_user_by_email', users_dao.get_user_by_email, lambda i: (data.pick(data.buyers, i)[1],)),
+        Case('users.get_user_by_id', users_dao.get_user_by_id, lambda i: (data.pick(data.buyers, i)[0],)),
+        Case('users.get_session_user', users_dao.get_session_user, session_user),
+        Case('users.get_session_user[cached]', users_dao.get_session_user, lambda i: (buyer_id,)),
+        Case('users.get_users_by_type[organizer]', users_dao.get_users_by_type, lambda i: ('organizer',)),
+        Case('users.get_users_by_type[participant]', users_dao.get_users_by_type, lambda i: ('participant',)),
+        Case('users.verify_user_credentials', users_dao.verify_user_credentials,
+             lambda i: (buyer_email, datagen.PASSWORD), HASH_REPEAT),
+
+        Case('stages.get_stages_cache_stats', stages_dao.get_stages_cache_stats),
+        Case('stages.get_all_stages', stages_dao.get_all_stages, _clear_stages_cache),
+        Case('stages.get_all_stages[cached]', stages_dao.get_all_stages),
+        Case('stages.get_stage_by_name', stages_dao.get_stage_by_name, lambda i: (data.stage,)),
+    ]
+    # Pre-caricamento fuori misura: le versioni [cached] e l'indice degli slot partono pronti
+    performances_dao.check_conflict(performance['stage_id'], day, '00:00', 1)
+    return cases
+
+
+def _write_cases(data):
+    drafts = []
+    password_hash = generate_password_hash('bench-password')
+
+    def add_draft(i):
+        performance_id = performances_dao.add_performance(data.draft(i))
+        drafts.append(performance_id)
+        return performance_id
+
+    def existing_draft(i):
+        return data.pick(drafts, i) if drafts else add_draft(i)
+
+    def fresh_buyer(i):
+        # Il giorno con più posti liberi, per misurare l'acquisto riuscito e non il sold out
+        availability = tickets_dao.get_daily_availability()
+        day = max(availability, key=availability.get)
+        user_id = data.fresh.pop()[0]
+        return ({'user_id': user_id, 'ticket_type': 'daily', 'days': day,
+                 'price': datagen.TICKET_PRICES['daily'],
+                 'purchase_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')},)
+
+    def draft_update(i):
+        performance_id = existing_draft(i)
+        values = performances_dao.get_performance(performance_id)
+        return (dict(values, description=f"Modifica {i}"),)
+
+    def new_user_id(i):
+        user = data.new_user()
+        users_dao.add_user(user)
+        return (users_dao.get_user_by_email(user['email'])['id'],)
+
+    return [
+        Case('performances.add_performance', lambda draft: drafts.append(performances_dao.add_performance(draft)),
+             lambda i: (data.draft(i),), WRITE_REPEAT),
+        Case('performances.update_performance', performances_dao.update_performance, draft_update, WRITE_REPEAT),
+        Case('performances.set_image_status', performances_dao.set_image_status,
+             lambda i: (existing_draft(i), 'bench.webp', 'ready', '200,400'), WRITE_REPEAT, checked=True),
+        Case('performances.publish_performance', performances_dao.publish_performance,
+             lambda i: (add_draft(i),), WRITE_REPEAT, checked=True),
+        Case('performances.publish_performances[10]', performances_dao.publish_performances,
+             lambda i: ([add_draft(i) for _ in range(10)], data.organizers[i % len(data.organizers)]),
+             WRITE_REPEAT),
+        Case('performances.delete_performance', performances_dao.delete_performance,
+             lambda i: (add_draft(i),), WRITE_REPEAT, checked=True),
+        Case('performances.remove_upload_deletions', performances_dao.remove_upload_deletions,
+             lambda i: ([f"missing-{i}.webp"],), WRITE_REPEAT),
+
+        Case('tickets.purchase_ticket', tickets_dao.purchase_ticket, fresh_buyer, WRITE_REPEAT),
+        Case('tickets.add_ticket', tickets_dao.add_ticket, fresh_buyer, WRITE_REPEAT, checked=True),
+        Case('tickets.rebuild_day_inventory', tickets_dao.rebuild_day_inventory, _no_args, WRITE_REPEAT),
+
+        Case('users.add_user', users_dao.add_user, lambda i: (data.new_user(),), WRITE_REPEAT,
+             checked=True),
+        Case('users.update_user', users_dao.update_user,
+             lambda i: (data.pick(data.buyers, i)[0], {'full_name': f"Bench {i}"}), WRITE_REPEAT,
+             checked=True),
+        Case('users.change_password', users_dao.change_password,
+             lambda i: (data.pick(data.buyers, i)[0], password_hash), WRITE_REPEAT,
+             checked=True),
+        Case('users.delete_user', users_dao.delete_user, new_user_id, WRITE_REPEAT, checked=True),
+    ]
+
+
+def _failed(case):
+    return {'repeat': 0, 'error': f"{case.call.__name__} ha restituito False"}
+
+
+def _measure(case, repeat, rounds=ROUNDS):
+    """Chiamate divise in round: median_us è la mediana del round migliore, la meno
+    disturbata dal resto della macchina; p95 e media sono su tutti i campioni."""
+    before = case.before or _no_args
+    repeat = min(case.repeat or repeat, repeat)
+    rounds = max(1, min(rounds, repeat))
+    call = case.call
+
+    # Riscaldamento: connessione, cache delle prepared statement, pagine del database.
+    # Un caso che fallisce (es. colonna mancante nello schema) viene riportato, non interrompe la suite.
+    # I DAO intercettano sqlite3.Error e restituiscono False: senza il controllo si misurerebbe il rollback
+    try:
+        for i in range(min(3, repeat)):
+            if call(*before(i)) is False and case.checked:
+                return _failed(case)
+    except sqlite3.Error as e:
+        return {'repeat': 0, 'error': str(e)}
+
+    samples = []
+    medians = []
+    for r in range(rounds):
+        round_samples = []
+        for i in range(r * repeat // rounds, (r + 1) * repeat // rounds):
+            args = before(i)
+            start = time.perf_counter()
+            result = call(*args)
+            round_samples.append(time.perf_counter() - start)
+            if result is False and case.checked:
+                return _failed(case)
+        round_samples.sort()
+        medians.append(round_samples[len(round_samples) // 2])
+        samples.extend(round_samples)
+
+    samples.sort()
+    return {
+        'repeat': repeat,
+        'median_us': round(min(medians) * 1e6, 1),
+        'p95_us': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1e6, 1),
+        'mean_us': round(sum(samples) / len(samples) * 1e6, 1),
+    }
+
+
+def _calibrate():
+    """Carico fisso (SQLite in memoria e Python puro): misura la velocità della macchina
+    in quel momento, per confrontare i risultati con la baseline a parità di condizioni."""
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE t (id INTEGER PRIMARY KEY, value TEXT)')
+    conn.executemany('INSERT INTO t (value) VALUES (?)', [(str(i),) for i in range(1000)])
+
+    def workload():
+        rows = conn.execute("SELECT id, value FROM t WHERE value LIKE '1%' ORDER BY value").fetchall()
+        return sum(len(value) for _, value in rows)
+
+    result = _measure(Case('calibration', workload), 200)
+    conn.close()
+    return result['median_us']
+
+
+def _reset_state(path):
+    """Nuovo database per i DAO e cache di modulo vuote."""
+    database.configure(path)
+    performances_dao._schedule_cache.clear()
+    performances_dao._schedule_index.invalidate()
+    stages_dao._stages_cache.clear()
+    users_dao._user_cache.clear()
+
+
+def run_size(size, workdir, repeat, seed, only):
+    path = os.path.join(workdir, f'{size}.db')
+    datagen.generate(path, seed=seed, **SIZES[size])
+    data = Dataset(path, seed)
+    _reset_state(path)
+
+    # Calibrazione prima e dopo: si tiene la misura più veloce
+    calibration = _calibrate()
+    results = {}
+    for build in (_read_cases, _write_cases):
+        for case in build(data):
+            if only and only not in case.name:
+                continue
+            result = results[case.name] = _measure(case, repeat)
+            timing = f"{result['median_us']:>10.1f} µs" if 'error' not in result else f"errore: {result['error']}"
+            print(f"  {size:<6} {case.name:<55} {timing}", file=sys.stderr)
+
+    database.close_all()
+    return results, min(calibration, _calibrate())
+
+
+def compare(report, baseline, threshold, min_delta_us):
+    """Casi più lenti della baseline oltre soglia: [(dimensione, caso, baseline µs, attuale µs)].
+
+    La baseline viene riscalata con il rapporto tra le calibrazioni, così una macchina
+    momentaneamente più lenta non fa scattare regressioni su tutti i casi.
+    """
+    regressions = []
+    for size, cases in report['results'].items():
+        scale = report['calibration'][size] / baseline.get('calibration', {}).get(size, report['calibration'][size])
+        for name, current in cases.items():
+            previous = baseline['results'].get(size, {}).get(name)
+            if previous is None or 'error' in previous or 'error' in current:
+                continue
+            before, after = previous['median_us'] * scale, current['median_us']
+            if after > before * (1 + threshold) and after - before > min_delta_us:
+                regressions.append((size, name, before, after))
+    return regressions
+
+
+def _confirm(regression, args, baseline):
+    """Rimisura un caso sospetto in processi nuovi: la velocità cambia da un processo
+    all'altro (allocazione, vicini sulla macchina), una regressione vera si ripete sempre."""
+    size, name, _, _ = regression
+    for _ in range(args.confirm):
+        with tempfile.NamedTemporaryFile(suffix='.json') as output:
+            subprocess.run([sys.executable, '-m', 'benchmarks.dao_bench', '--sizes', size, '--only', name,
+                            '--repeat', str(args.repeat), '--seed', str(args.seed), '--workdir', args.workdir,
+                            '--baseline', output.name, '--save-baseline'],
+                           check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            report = json.load(output)
+        # Solo il caso in esame: --only seleziona per sottostringa
+        report['results'] = {size: {name: report['results'][size][name]}}
+        if not compare(report, baseline, args.threshold, args.min_delta_us):
+            return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=list(SIZES))
+    parser.add_argument('--repeat', type=int, default=200, help='chiamate per caso di lettura')
+    parser.add_argument('--only', help='solo i casi il cui nome contiene questo testo')
+    parser.add_argument('--seed', type=int, default=2025)
+    parser.add_argument('--workdir', default=os.path.join('/tmp', 'festival_dao_bench'))
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='scrive i risultati come nuova baseline')
+    parser.add_argument('--threshold', type=float, default=0.25, help='rallentamento relativo tollerato')
+    parser.add_argument('--min-delta-us', type=float, default=20.0)
+    parser.add_argument('--confirm', type=int, default=2,
+                        help='processi in cui una regressione deve ripetersi per essere segnalata')
+    parser.add_argument('--output', help='file JSON con i risultati di questa esecuzione')
+    args = parser.parse_args()
+
+    os.makedirs(args.workdir, exist_ok=True)
+    results = {}
+    calibration = {}
+    # I DAO stampano messaggi diagnostici (es. conflitti di pubblicazione)
+    with contextlib.redirect_stdout(io.StringIO()):
+        for size in args.sizes:
+            results[size], calibration[size] = run_size(size, args.workdir, args.repeat, args.seed, args.only)
+
+    report = {
+        'meta': {'seed': args.seed, 'repeat': args.repeat, 'sizes': {size: SIZES[size] for size in args.sizes},
+                 'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version,
+                 'machine': platform.node(), 'date': datetime.now().isoformat(timespec='seconds')},
+        'calibration': calibration,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as target:
+            json.dump(report, target, indent=2)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as target:
+            json.dump(report, target, indent=2)
+        print(f"baseline salvata in {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"nessuna baseline in {args.baseline}: eseguire con --save-baseline")
+        return
+
+    with open(args.baseline) as source:
+        baseline = json.load(source)
+    if baseline['meta'].get('machine') != report['meta']['machine']:
+        print(f"attenzione: baseline registrata su {baseline['meta'].get('machine')}")
+
+    regressions = [regression for regression in compare(report, baseline, args.threshold, args.min_delta_us)
+                   if _confirm(regression, args, baseline)]
+    for size, name, before, after in regressions:
+        print(f"REGRESSIONE {size} {name}: attesi {before:.1f} µs, misurati {after:.1f} ({after / before - 1:+.0%})")
+    if regressions:
+        sys.exit(1)
+    print(f"nessuna regressione oltre il {args.threshold:.0%} su {sum(len(c) for c in results.values())} casi")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""Generatore di un database del festival di dimensioni configurabili.
+
+Parte dallo schema e dai palchi di db/festival.db, applica le migrazioni e
+inserisce utenti, performance e biglietti sintetici. Con lo stesso --seed il
+contenuto generato è identico:
+
+    python -m benchmarks.datagen /tmp/festival_scale.db --participants 5000 --performances 300 --stages 12
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+
+from werkzeug.security import generate_password_hash
+
+import migrations
+import tickets_dao
+
+SOURCE_DATABASE = 'db/festival.db'
+PASSWORD = 'password123'
+DAYS = ['venerdi', 'sabato', 'domenica']
+TICKET_PRICES = {'daily': 50.0, '2days': 90.0, 'full': 130.0}
+DAY_DATES = {'venerdi': '2025-07-12', 'sabato': '2025-07-13', 'domenica': '2025-07-14'}
+GENRES = ["Rock", "Pop", "Jazz", "Electronic", "Folk", "Hip-Hop", "Classical", "Blues"]
+WORDS = ("suono palco ritmo notte festival chitarra basso voce luci danza colore sogno "
+         "energia groove eco vento fuoco onda città estate").split()
+
+# Fascia oraria degli slot di ogni palco (minuti dalla mezzanotte)
+FIRST_SLOT = 12 * 60
+LAST_SLOT_END = 24 * 60
+
+
+def _participant_email(i):
+    return f"partecipante{i}@bench.test"
+
+
+def _organizer_email(i):
+    return f"organizzatore{i}@bench.test"
+
+
+def _reset(path):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def generate(path, participants=2000, organizers=20, performances=300, tickets=300, stages=12,
+             drafts_ratio=0.1, seed=2025):
+    """Crea il database in path. Restituisce il riepilogo di quanto generato."""
+    rng = random.Random(seed)
+    _reset(path)
+    shutil.copy(SOURCE_DATABASE, path)
+
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    migrations.apply_migrations(conn)
+
+    # Stessi palchi, nessun altro dato dell'esempio
+    for table in ('tickets', 'performances', 'users'):
+        conn.execute(f'DELETE FROM {table}')
+    conn.execute('UPDATE day_inventory SET sold = 0')
+
+    # Un solo hash per tutti: il KDF costa centinaia di ms a utente
+    password_hash = generate_password_hash(PASSWORD)
+    conn.executemany('INSERT INTO users (email, password, full_name, user_type) VALUES (?, ?, ?, ?)',
+                     [(_organizer_email(i), password_hash, f"Organizzatore {i}", 'organizer')
+                      for i in range(organizers)] +
+                     [(_participant_email(i), password_hash, f"Partecipante {i}", 'participant')
+                      for i in range(participants)])
+    organizer_ids = [row[0] for row in conn.execute("SELECT id FROM users WHERE user_type = 'organizer'")]
+    participant_ids = [row[0] for row in conn.execute("SELECT id FROM users WHERE user_type = 'participant'")]
+
+    # Palchi dell'esempio più palchi sintetici fino a `stages`
+    existing = conn.execute('SELECT COUNT(*) FROM stages').fetchone()[0]
+    conn.executemany('INSERT INTO stages (name, capacity, description) VALUES (?, ?, ?)',
+                     [(f"Stage {i}", rng.choice((200, 500, 1000)), f"Palco sintetico {i}")
+                      for i in range(existing + 1, stages + 1)])
+    stage_ids = [row[0] for row in conn.execute('SELECT id FROM stages ORDER BY id')]
+    images = sorted(name for name in os.listdir('static/uploads') if not name.startswith('.'))
+
+    # Slot consecutivi per (palco, giorno): nessun conflitto tra performance pubblicate
+    slots = []
+    for day in DAYS:
+        for stage_id in stage_ids:
+            start = FIRST_SLOT
+            while True:
+                duration = rng.choice((30, 45, 60, 75, 90))
+                if start + duration > LAST_SLOT_END:
+                    break
+                slots.append((day, stage_id, start, duration))
+                start += duration + rng.choice((0, 15, 30))
+    rng.shuffle(slots)
+    if performances > len(slots):
+        raise ValueError(f"al massimo {len(slots)} performance senza conflitti con questi palchi")
+
+    rows = []
+    for i, (day, stage_id, start, duration) in enumerate(slots[:performances]):
+        description = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(25, 60))).capitalize() + '.'
+        rows.append((f"Artista {i:04d} {rng.choice(WORDS).title()}", DAY_DATES[day],
+                     f"{start // 60:02d}:{start % 60:02d}", duration, description, stage_id,
+                     rng.choice(GENRES), rng.choice(images) if images else '',
+                     rng.choice(organizer_ids), 0 if rng.random() < drafts_ratio else 1))
+    conn.executemany('''INSERT INTO performances
+                        (artist_name, day, start_time, duration, description, stage_id, genre,
+                         performance_image, organizer_id, published)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+
+    # Biglietti entro la capienza giornaliera, un biglietto per partecipante
+    sold = dict.fromkeys(DAYS, 0)
+    ticket_rows = []
+    buyers = rng.sample(participant_ids, min(tickets, len(participant_ids)))
+    for user_id in buyers:
+        ticket_type = rng.choices(('daily', '2days', 'full'), weights=(6, 3, 1))[0]
+        if ticket_type == 'daily':
+            days = [rng.choice(DAYS)]
+        elif ticket_type == '2days':
+            first = rng.randrange(2)
+            days = DAYS[first:first + 2]
+        else:
+            days = list(DAYS)
+        if any(sold[day] >= tickets_dao.MAX_DAILY_CAPACITY for day in days):
+            continue
+        for day in days:
+            sold[day] += 1
+        ticket_rows.append((user_id, ticket_type, ','.join(days), TICKET_PRICES[ticket_type]))
+    conn.executemany('INSERT INTO tickets (user_id, ticket_type, days, price) VALUES (?, ?, ?, ?)',
+                     ticket_rows)
+
+    conn.commit()
+    conn.execute('VACUUM')
+    conn.close()
+
+    return {
+        'database': path,
+        'seed': seed,
+        'participants': participants,
+        'organizers': organizers,
+        'stages': len(stage_ids),
+        'performances': len(rows),
+        'published': sum(1 for row in rows if row[-1]),
+        'tickets': len(ticket_rows),
+        'sold_by_day': sold,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path')
+    parser.add_argument('--participants', type=int, default=2000)
+    parser.add_argument('--organizers', type=int, default=20)
+    parser.add_argument('--performances', type=int, default=300)
+    parser.add_argument('--tickets', type=int, default=300)
+    parser.add_argument('--stages', type=int, default=12)
+    parser.add_argument('--seed', type=int, default=2025)
+    args = parser.parse_args()
+
+    summary = generate(args.path, args.participants, args.organizers, args.performances,
+                       args.tickets, args.stages, seed=args.seed)
+    print(summary)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""Tempo di rendering della home con e senza cache dei frammenti delle card.
+
+    python -m benchmarks.home_render [--requests 200]
+"""
+import argparse
+import time
+
+import app as festival
+import performances_dao
+
+URLS = ['/', '/?day=2025-07-12', '/?day=2025-07-13', '/?genre=Rock', '/?stage=Main Stage']
+
+
+def _run(client, requests):
+    start = time.perf_counter()
+    for i in range(requests):
+        response = client.get(URLS[i % len(URLS)])
+        assert response.status_code == 200
+    return (time.perf_counter() - start) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    client = festival.app.test_client()
+    # Elenchi già in cache: si misura solo il rendering
+    _run(client, len(URLS))
+
+    card_cache = festival._card_cache
+    with_cache = _run(client, args.requests)
+
+    # Senza cache: ogni chiamata trova una cache vuota
+    original = card_cache.get_or_render
+    card_cache.get_or_render = lambda key, render: render()
+    try:
+        without_cache = _run(client, args.requests)
+    finally:
+        card_cache.get_or_render = original
+
+    stats = festival.get_card_cache_stats()
+    print(f"versione programma: {performances_dao.get_schedule_version()}")
+    print(f"senza cache frammenti: {without_cache * 1000:.2f} ms/richiesta")
+    print(f"con cache frammenti:   {with_cache * 1000:.2f} ms/richiesta "
+          f"({1 - with_cache / without_cache:.0%} in meno)")
+    print(f"hit ratio {stats['hit_ratio']:.1%}, rendering risparmiato stimato {stats['saved_seconds']:.3f} s")
+
+
+if __name__ == '__main__':
+    main()
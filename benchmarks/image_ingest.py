@@ -0,0 +1,128 @@
+"""Confronto tra la decodifica a piena risoluzione e quella ridotta di image_pipeline.
+
+Ogni misura gira in un processo separato, così il picco di RSS è quello del solo job:
+
+    python -m benchmarks.image_ingest [--repeat 3]
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+import image_pipeline
+
+SAMPLES = [
+    ('jpeg_24mp.jpg', 'JPEG', (6000, 4000)),
+    ('jpeg_12mp.jpg', 'JPEG', (4000, 3000)),
+    ('png_12mp.png', 'PNG', (4000, 3000)),
+]
+
+
+def _make_samples(folder):
+    """Immagini sintetiche con gradiente e rumore, per non favorire il codec."""
+    paths = []
+    for name, image_format, size in SAMPLES:
+        path = os.path.join(folder, name)
+        if not os.path.exists(path):
+            gradient = Image.linear_gradient('L').resize(size)
+            noise = Image.effect_noise(size, 64)
+            Image.merge('RGB', (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT))).save(
+                path, image_format, **({'quality': 90} if image_format == 'JPEG' else {}))
+        paths.append(path)
+    return paths
+
+
+def _legacy(raw_path, output_path):
+    """Il vecchio save_image: convert a piena risoluzione, crop, resize 450x450."""
+    img = Image.open(raw_path).convert("RGB")
+    left, top, right, bottom = image_pipeline._crop_box(img.width, img.height)
+    img = img.crop((left, top, right, bottom))
+    img = img.resize((image_pipeline.TARGET_WIDTH, image_pipeline.TARGET_HEIGHT), Image.Resampling.LANCZOS)
+    img.save(output_path, "WebP", quality=40, optimize=True)
+
+
+def _reduced(raw_path, output_path):
+    """Stesso output del vecchio percorso, con la decodifica ridotta di image_pipeline."""
+    with Image.open(raw_path) as source:
+        img = image_pipeline._load_cropped(source)
+    img.resize((image_pipeline.TARGET_WIDTH, image_pipeline.TARGET_HEIGHT), Image.Resampling.LANCZOS).save(
+        output_path, "WebP", quality=40, optimize=True)
+
+
+def _pipeline(raw_path, output_path):
+    """process_image completo, derivate comprese (elimina il grezzo: lavora su una copia)."""
+    copy_path = output_path + os.path.splitext(raw_path)[1]
+    with open(raw_path, 'rb') as source, open(copy_path, 'wb') as target:
+        target.write(source.read())
+    image_pipeline.process_image(copy_path, output_path)
+
+
+def _peak_rss_kib():
+    """Picco RSS del processo. VmHWM riparte da zero a ogni exec, ru_maxrss no."""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _run_one(method, raw_path):
+    """Eseguito nel processo figlio: stampa secondi e picco RSS in KiB."""
+    output_path = os.path.join(tempfile.mkdtemp(), 'out.webp')
+    start = time.perf_counter()
+    if method in METHODS:
+        METHODS[method](raw_path, output_path)
+    elapsed = time.perf_counter() - start
+    print(f"{elapsed:.4f} {_peak_rss_kib()}")
+
+
+METHODS = {'legacy': _legacy, 'reduced': _reduced, 'pipeline': _pipeline}
+
+
+def _measure(method, raw_path):
+    result = subprocess.run([sys.executable, '-m', 'benchmarks.image_ingest', '--child', method, raw_path],
+                            capture_output=True, text=True, check=True)
+    elapsed, rss = result.stdout.split()
+    return float(elapsed), int(rss)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--samples', default=os.path.join(tempfile.gettempdir(), 'festival_image_samples'))
+    parser.add_argument('--child', nargs=2, metavar=('METHOD', 'PATH'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _run_one(*args.child)
+        return
+
+    os.makedirs(args.samples, exist_ok=True)
+    _, baseline_rss = _measure('none', _make_samples(args.samples)[0])
+    print(f"RSS di base dell'interprete: {baseline_rss / 1024:.0f} MiB")
+    print(f"{'campione':<16}{'metodo':<10}{'tempo (s)':>10}{'picco RSS (MiB)':>17}")
+
+    for path in _make_samples(args.samples):
+        results = {}
+        for method in METHODS:
+            runs = [_measure(method, path) for _ in range(args.repeat)]
+            elapsed = min(run[0] for run in runs)
+            rss = max(run[1] for run in runs) - baseline_rss
+            results[method] = (elapsed, rss)
+            print(f"{os.path.basename(path):<16}{method:<10}{elapsed:>10.3f}{rss / 1024:>17.1f}")
+
+        # Risparmio a parità di output (solo 450x450)
+        (old_time, old_rss), (new_time, new_rss) = results['legacy'], results['reduced']
+        print(f"{'':<16}{'risparmio':<10}{1 - new_time / old_time:>10.0%}{1 - new_rss / max(old_rss, 1):>17.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+"""Load test dell'app Flask reale su un database generato da benchmarks.datagen.
+
+Le richieste passano per l'intero stack WSGI dell'app (routing, sessioni,
+Flask-Login, DAO, template) tramite il test client, senza rete. Due fasi:
+- mix: thread che per --duration secondi alternano home con filtri, dettaglio
+  performance, login e profilo organizzatore;
+- rush: --rush-buyers partecipanti senza biglietto comprano insieme lo stesso
+  giorno; alla fine si verifica che la capienza non sia stata superata.
+
+Il report JSON (stdout o --output) ha throughput e p50/p95/p99 per route:
+
+    python -m benchmarks.datagen /tmp/festival_scale.db
+    python -m benchmarks.loadtest /tmp/festival_scale.db --threads 8 --duration 10 --output run.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import random
+import sqlite3
+import threading
+import time
+from collections import Counter, defaultdict
+
+import app as festival
+import database
+import tickets_dao
+import throttle
+from benchmarks.datagen import DAY_DATES, DAYS, GENRES, PASSWORD
+
+# Peso di ogni scenario nella fase mista
+MIX = [('home', 5), ('detail', 3), ('login', 1), ('organizer_profile', 1)]
+
+
+class Recorder:
+    """Latenze e status per route, condiviso tra i thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+
+    def request(self, route, send):
+        start = time.perf_counter()
+        response = send()
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.latencies[route].append(elapsed)
+            self.statuses[route][response.status_code] += 1
+        return response
+
+    def report(self, phase_seconds):
+        routes = {}
+        for route, samples in sorted(self.latencies.items()):
+            samples = sorted(samples)
+            statuses = self.statuses[route]
+            routes[route] = {
+                'requests': len(samples),
+                'errors': sum(count for status, count in statuses.items() if status >= 500),
+                'statuses': {str(status): count for status, count in sorted(statuses.items())},
+                'throughput_rps': round(len(samples) / phase_seconds[route], 1),
+                'mean_ms': round(sum(samples) / len(samples) * 1000, 2),
+                'p50_ms': _percentile(samples, 50),
+                'p95_ms': _percentile(samples, 95),
+                'p99_ms': _percentile(samples, 99),
+            }
+        return routes
+
+
+def _percentile(ordered, percent):
+    """Nearest-rank su campioni già ordinati, in millisecondi."""
+    index = max(0, min(len(ordered) - 1, round(percent / 100 * len(ordered)) - 1))
+    return round(ordered[index] * 1000, 2)
+
+
+def _ip(rng):
+    return f"10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}"
+
+
+def _login(client, email, ip):
+    return client.post('/login', data={'email': email, 'password': PASSWORD},
+                       environ_base={'REMOTE_ADDR': ip})
+
+
+def _load_fixture(path):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    fixture = {
+        'published_ids': [row[0] for row in conn.execute('SELECT id FROM performances WHERE published = 1')],
+        'stages': [row[0] for row in conn.execute('SELECT name FROM stages')],
+        'organizers': [row[0] for row in conn.execute("SELECT email FROM users WHERE user_type = 'organizer'")],
+        'participants': [row[0] for row in conn.execute('''SELECT email FROM users
+                                                         WHERE user_type = 'participant'
+                                                           AND id NOT IN (SELECT user_id FROM tickets)''')],
+        'sold': {row['day']: row['sold'] for row in conn.execute('SELECT day, sold FROM day_inventory')},
+    }
+    conn.close()
+    return fixture
+
+
+def _mix_worker(recorder, fixture, organizer, deadline, seed):
+    rng = random.Random(seed)
+    client = festival.app.test_client()
+
+    scenarios = [name for name, weight in MIX for _ in range(weight)]
+    while time.perf_counter() < deadline:
+        scenario = rng.choice(scenarios)
+        if scenario == 'home':
+            params = {}
+            if rng.random() < 0.5:
+                params['day'] = rng.choice(list(DAY_DATES.values()))
+            if rng.random() < 0.3:
+                params['stage'] = rng.choice(fixture['stages'])
+            if rng.random() < 0.3:
+                params['genre'] = rng.choice(GENRES)
+            recorder.request('GET /', lambda: client.get('/', query_string=params))
+        elif scenario == 'detail':
+            performance_id = rng.choice(fixture['published_ids'])
+            recorder.request('GET /performance/<id>', lambda: client.get(f'/performance/{performance_id}'))
+        elif scenario == 'login':
+            # Client nuovo e IP casuale: si misura il login, non i limiti per IP
+            visitor = festival.app.test_client()
+            email = rng.choice(fixture['participants'])
+            recorder.request('POST /login', lambda: _login(visitor, email, _ip(rng)))
+        else:
+            recorder.request('GET /profile (organizer)', lambda: organizer.get('/profile'))
+
+
+def run_mix(recorder, fixture, threads, duration, seed):
+    # Un organizzatore già autenticato per thread, prima di far partire il tempo
+    rng = random.Random(seed)
+    organizers = []
+    for _ in range(threads):
+        organizer = festival.app.test_client()
+        _login(organizer, rng.choice(fixture['organizers']), _ip(rng))
+        organizers.append(organizer)
+
+    deadline = time.perf_counter() + duration
+    workers = [threading.Thread(target=_mix_worker,
+                                args=(recorder, fixture, organizers[i], deadline, seed + i))
+               for i in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start
+
+
+def run_rush(recorder, fixture, path, buyers, seed):
+    """Tutti i compratori inviano insieme un biglietto giornaliero per il giorno più libero."""
+    rng = random.Random(seed)
+    day = min(DAYS, key=lambda name: fixture['sold'].get(name, 0))
+    remaining = tickets_dao.MAX_DAILY_CAPACITY - fixture['sold'].get(day, 0)
+
+    # Login fuori dalla misura, in sequenza: il tetto agli hash concorrenti non interviene
+    clients = []
+    for email in rng.sample(fixture['participants'], min(buyers, len(fixture['participants']))):
+        client = festival.app.test_client()
+        _login(client, email, _ip(rng))
+        clients.append(client)
+
+    barrier = threading.Barrier(len(clients))
+    outcomes = Counter()
+    outcomes_lock = threading.Lock()
+
+    def buy(client):
+        barrier.wait()
+        response = recorder.request('POST /buy_ticket (rush)', lambda: client.post(
+            '/buy_ticket', data={'ticket_type': 'daily', 'single_day': day}))
+        # Successo -> profilo, rifiuto -> di nuovo alla pagina di acquisto
+        outcome = 'bought' if response.headers.get('Location', '').endswith('/profile') else 'rejected'
+        with outcomes_lock:
+            outcomes[outcome] += 1
+
+    workers = [threading.Thread(target=buy, args=(client,)) for client in clients]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    conn = sqlite3.connect(path)
+    sold = conn.execute('SELECT COUNT(*) FROM ticket_days WHERE day = ?', (day,)).fetchone()[0]
+    counter = conn.execute('SELECT sold FROM day_inventory WHERE day = ?', (day,)).fetchone()[0]
+    conn.close()
+
+    return elapsed, {
+        'day': day,
+        'buyers': len(clients),
+        'remaining_before': remaining,
+        'bought': outcomes['bought'],
+        'rejected': outcomes['rejected'],
+        'sold_after': sold,
+        'inventory_counter': counter,
+        'capacity': tickets_dao.MAX_DAILY_CAPACITY,
+        'oversold': sold > tickets_dao.MAX_DAILY_CAPACITY,
+        'counter_consistent': sold == counter,
+        'expected_bought': min(len(clients), remaining),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('database', help='database generato con benchmarks.datagen (viene modificato)')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0, help='secondi della fase mista')
+    parser.add_argument('--rush-buyers', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=2025)
+    parser.add_argument('--hash-concurrency', type=int,
+                        help="posti per gli hash delle password (default: quello dell'app)")
+    parser.add_argument('--output', help='file JSON del report (default: stdout)')
+    args = parser.parse_args()
+
+    festival.app.config['DATABASE'] = args.database
+    database.configure(args.database, pool_size=max(args.threads, args.rush_buyers) + 4)
+    if args.hash_concurrency:
+        festival.app.config['HASH_CONCURRENCY'] = args.hash_concurrency
+        throttle.init_app(festival.app)
+    fixture = _load_fixture(args.database)
+
+    recorder = Recorder()
+    # I DAO stampano messaggi diagnostici: il report deve restare JSON valido
+    with contextlib.redirect_stdout(io.StringIO()):
+        mix_seconds = run_mix(recorder, fixture, args.threads, args.duration, args.seed)
+        rush_seconds, rush = run_rush(recorder, fixture, args.database, args.rush_buyers, args.seed)
+
+    phase_seconds = defaultdict(lambda: mix_seconds, {'POST /buy_ticket (rush)': rush_seconds})
+    report = {
+        'config': {'database': args.database, 'threads': args.threads, 'duration': args.duration,
+                   'rush_buyers': args.rush_buyers, 'seed': args.seed,
+                   'hash_concurrency': festival.app.config['HASH_CONCURRENCY']},
+        'routes': recorder.report(phase_seconds),
+        'rush': rush,
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as target:
+            target.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
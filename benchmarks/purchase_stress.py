@@ -0,0 +1,173 @@
+"""Stress test di concorrenza per tickets_dao.purchase_ticket: nessun overselling.
+
+Su una copia temporanea del database un giorno viene riempito fino a lasciare
+--seats posti; poi --threads utenti nuovi partono insieme (barriera) per
+comprarli, con biglietti giornalieri, pass 2 giorni e full pass che includono
+quel giorno. Una parte degli utenti riprova l'acquisto. Alla fine si verifica che:
+- i venduti di ogni giorno non superino MAX_DAILY_CAPACITY;
+- day_inventory coincida con il conteggio di ticket_days;
+- nessun utente abbia più di un biglietto;
+- siano stati venduti esattamente i posti rimasti (nessun rifiuto ingiustificato).
+
+    python -m benchmarks.purchase_stress [--threads 64 --seats 5 --rounds 5]
+
+Esce con codice 1 alla prima violazione.
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+from collections import Counter
+from datetime import datetime
+
+import database
+import migrations
+import tickets_dao
+
+SOURCE_DATABASE = 'db/festival.db'
+DAYS = ['venerdi', 'sabato', 'domenica']
+PRICES = {'daily': 50.0, '2days': 90.0, 'full': 130.0}
+
+
+def _prepare(path, day, seats, buyers):
+    """Copia il database, riempie `day` fino a lasciare `seats` posti e crea gli utenti compratori."""
+    shutil.copy(SOURCE_DATABASE, path)
+    conn = sqlite3.connect(path)
+    migrations.apply_migrations(conn)
+
+    sold = conn.execute('SELECT sold FROM day_inventory WHERE day = ?', (day,)).fetchone()[0]
+    fillers = tickets_dao.MAX_DAILY_CAPACITY - sold - seats
+    if fillers < 0:
+        raise ValueError(f"{day} ha già meno di {seats} posti liberi")
+
+    # Biglietti di riempimento: i trigger aggiornano ticket_days e day_inventory
+    conn.executemany('INSERT INTO users (email, password, full_name, user_type) VALUES (?, ?, ?, ?)',
+                     [(f"riempimento{i}@stress.test", '-', f"Riempimento {i}", 'participant')
+                      for i in range(fillers)])
+    conn.execute('''INSERT INTO tickets (user_id, ticket_type, days, price)
+                    SELECT id, 'daily', ?, ? FROM users WHERE email LIKE 'riempimento%@stress.test' ''',
+                 (day, PRICES['daily']))
+
+    conn.executemany('INSERT INTO users (email, password, full_name, user_type) VALUES (?, ?, ?, ?)',
+                     [(f"compratore{i}@stress.test", '-', f"Compratore {i}", 'participant')
+                      for i in range(buyers)])
+    user_ids = [row[0] for row in conn.execute(
+        "SELECT id FROM users WHERE email LIKE 'compratore%@stress.test' ORDER BY id")]
+    conn.commit()
+    conn.close()
+    return user_ids
+
+
+def _ticket_for(rng, day):
+    """Biglietto casuale che include `day`: (tipo, giorni separati da virgola)."""
+    ticket_type = rng.choice(('daily', 'daily', '2days', 'full'))
+    if ticket_type == 'daily':
+        return ticket_type, day
+    if ticket_type == '2days':
+        other = rng.choice([d for d in DAYS if d != day])
+        return ticket_type, ','.join(sorted((day, other), key=DAYS.index))
+    return ticket_type, ','.join(DAYS)
+
+
+def run_round(path, day, seats, threads, retry_ratio, seed):
+    """Un giro di acquisti concorrenti. Restituisce (esiti, violazioni)."""
+    rng = random.Random(seed)
+    user_ids = _prepare(path, day, seats, threads)
+    database.configure(path, pool_size=threads)
+
+    barrier = threading.Barrier(threads)
+    outcomes = Counter()
+    lock = threading.Lock()
+
+    def buyer(user_id, ticket_type, days, attempts):
+        barrier.wait()
+        try:
+            for _ in range(attempts):
+                outcome, _ = tickets_dao.purchase_ticket({
+                    'user_id': user_id, 'ticket_type': ticket_type, 'days': days,
+                    'price': PRICES[ticket_type],
+                    'purchase_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')})
+                with lock:
+                    outcomes[outcome] += 1
+        finally:
+            database.release_connection()
+
+    workers = []
+    for user_id in user_ids:
+        ticket_type, days = _ticket_for(rng, day)
+        attempts = 2 if rng.random() < retry_ratio else 1
+        workers.append(threading.Thread(target=buyer, args=(user_id, ticket_type, days, attempts)))
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    database.close_all()
+
+    return outcomes, _check(path, user_ids, seats, outcomes)
+
+
+def _check(path, user_ids, seats, outcomes):
+    conn = sqlite3.connect(path)
+    violations = []
+
+    counted = dict(conn.execute('SELECT day, COUNT(*) FROM ticket_days GROUP BY day').fetchall())
+    stored = dict(conn.execute('SELECT day, sold FROM day_inventory').fetchall())
+    for day in DAYS:
+        if counted.get(day, 0) > tickets_dao.MAX_DAILY_CAPACITY:
+            violations.append(f"overselling {day}: {counted[day]} > {tickets_dao.MAX_DAILY_CAPACITY}")
+        if counted.get(day, 0) != stored.get(day, 0):
+            violations.append(f"day_inventory {day}: {stored.get(day, 0)}, ticket_days {counted.get(day, 0)}")
+
+    placeholders = ', '.join('?' for _ in user_ids)
+    for user_id, count in conn.execute(f'''SELECT user_id, COUNT(*) FROM tickets
+                                           WHERE user_id IN ({placeholders})
+                                           GROUP BY user_id HAVING COUNT(*) > 1''', user_ids):
+        violations.append(f"utente {user_id} con {count} biglietti")
+
+    expected = min(seats, len(user_ids))
+    if outcomes[tickets_dao.PURCHASE_SUCCESS] != expected:
+        violations.append(f"venduti {outcomes[tickets_dao.PURCHASE_SUCCESS]} biglietti, attesi {expected}")
+    if outcomes[tickets_dao.PURCHASE_ERROR]:
+        violations.append(f"{outcomes[tickets_dao.PURCHASE_ERROR]} acquisti falliti per errore del database")
+
+    conn.close()
+    return violations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=64, help='compratori concorrenti')
+    parser.add_argument('--seats', type=int, default=5, help='posti lasciati liberi prima della corsa')
+    parser.add_argument('--day', choices=DAYS, default='domenica')
+    parser.add_argument('--retry-ratio', type=float, default=0.3, help='quota di utenti che riprova')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=2025)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='festival_stress_')
+    try:
+        for round_number in range(args.rounds):
+            path = os.path.join(workdir, f'round{round_number}.db')
+            # I DAO stampano messaggi diagnostici a ogni rifiuto
+            with contextlib.redirect_stdout(io.StringIO()):
+                outcomes, violations = run_round(path, args.day, args.seats, args.threads,
+                                                 args.retry_ratio, args.seed + round_number)
+            print(f"giro {round_number + 1}: {dict(outcomes)}")
+            for violation in violations:
+                print(f"VIOLAZIONE: {violation}")
+            if violations:
+                sys.exit(1)
+    finally:
+        shutil.rmtree(workdir)
+
+    print(f"nessun overselling in {args.rounds} giri da {args.threads} compratori per {args.seats} posti")
+
+
+if __name__ == '__main__':
+    main()
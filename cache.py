@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Cache in memoria con dimensione massima ed eliminazione LRU. Thread-safe.
+
+    Con ttl (secondi) le voci scadono anche se usate spesso: limita quanto
+    a lungo un processo può servire un dato modificato da un altro processo.
+    """
+
+    def __init__(self, maxsize=128, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """Restituisce il valore e lo segna come usato di recente."""
+        with self._lock:
+            if key in self._data:
+                value, expires = self._data[key]
+                if expires is None or expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        """Inserisce il valore eliminando il meno usato se la cache è piena."""
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        """Invalida una singola voce."""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """Contatori per il monitoraggio."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hit_ratio': self.hits / total if total else 0.0
+            }
+
+
+class FragmentCache(LRUCache):
+    """Cache di frammenti HTML renderizzati. Misura il tempo di rendering risparmiato."""
+
+    def __init__(self, maxsize=512):
+        super().__init__(maxsize)
+        self.render_seconds = 0.0
+        self.renders = 0
+
+    def get_or_render(self, key, render):
+        """Frammento in cache o appena renderizzato con render()."""
+        fragment = self.get(key)
+        if fragment is not None:
+            return fragment
+
+        start = time.perf_counter()
+        fragment = render()
+        elapsed = time.perf_counter() - start
+
+        self.set(key, fragment)
+        with self._lock:
+            self.render_seconds += elapsed
+            self.renders += 1
+        return fragment
+
+    def stats(self):
+        """Come LRUCache.stats, più il tempo di rendering speso e quello stimato risparmiato."""
+        stats = super().stats()
+        with self._lock:
+            average = self.render_seconds / self.renders if self.renders else 0.0
+            stats['render_seconds'] = self.render_seconds
+            stats['saved_seconds'] = self.hits * average
+        return stats
@@ -0,0 +1,145 @@
+import sqlite3
+import threading
+from queue import LifoQueue, Empty, Full
+
+import migrations
+
+# Configurazione di default (sovrascrivibile da app.config tramite init_app)
+DEFAULT_DATABASE = 'db/festival.db'
+DEFAULT_POOL_SIZE = 8
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',        # Letture concorrenti durante le scritture
+    'synchronous': 'NORMAL',      # Sicuro con WAL, molte meno fsync
+    'mmap_size': 268435456,       # 256 MB di file mappato in memoria
+    'cache_size': -16000,         # ~16 MB di page cache per connessione
+    'busy_timeout': 5000,         # Attende i lock invece di fallire subito
+}
+
+_config = {
+    'database': DEFAULT_DATABASE,
+    'pragmas': dict(DEFAULT_PRAGMAS),
+    'pool_size': DEFAULT_POOL_SIZE,
+    'factory': sqlite3.Connection,
+}
+
+_pool = LifoQueue(maxsize=DEFAULT_POOL_SIZE)
+_local = threading.local()
+_lock = threading.Lock()
+_generation = 0
+_migrated_generation = None
+
+
+def configure(database=None, pragmas=None, pool_size=None, factory=None):
+    """Imposta percorso, pragma, dimensione pool e classe delle connessioni. Svuota il pool esistente."""
+    global _pool, _generation
+
+    with _lock:
+        if database is not None:
+            _config['database'] = database
+        if pragmas is not None:
+            _config['pragmas'] = dict(pragmas)
+        if pool_size is not None:
+            _config['pool_size'] = pool_size
+        if factory is not None:
+            _config['factory'] = factory
+
+        old_pool = _pool
+        _pool = LifoQueue(maxsize=_config['pool_size'])
+        # Le connessioni già prese dai thread vengono scartate al rilascio
+        _generation += 1
+
+    _drain(old_pool)
+
+
+def init_app(app):
+    """Collega il modulo all'app Flask: configurazione da app.config e rilascio a fine richiesta."""
+    app.config.setdefault('DATABASE', DEFAULT_DATABASE)
+    app.config.setdefault('DATABASE_POOL_SIZE', DEFAULT_POOL_SIZE)
+    app.config.setdefault('SQLITE_PRAGMAS', dict(DEFAULT_PRAGMAS))
+
+    configure(app.config['DATABASE'],
+              app.config['SQLITE_PRAGMAS'],
+              app.config['DATABASE_POOL_SIZE'])
+
+    @app.teardown_appcontext
+    def _release_db_connection(exception=None):
+        release_connection()
+
+
+def _connect():
+    """Apre una nuova connessione e applica i pragma una sola volta."""
+    conn = sqlite3.connect(_config['database'], check_same_thread=False, factory=_config['factory'])
+    conn.row_factory = sqlite3.Row
+
+    for name, value in _config['pragmas'].items():
+        conn.execute(f'PRAGMA {name} = {value}')
+
+    _ensure_schema(conn)
+    return conn
+
+
+def _ensure_schema(conn):
+    """Applica le migrazioni mancanti alla prima connessione dopo ogni configure()."""
+    global _migrated_generation
+
+    if _migrated_generation == _generation:
+        return
+
+    with _lock:
+        if _migrated_generation != _generation:
+            migrations.apply_migrations(conn)
+            _migrated_generation = _generation
+
+
+def get_connection():
+    """Restituisce la connessione del thread corrente, prendendola dal pool se necessario."""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.generation == _generation:
+        return conn
+
+    generation = _generation
+    try:
+        conn = _pool.get_nowait()
+    except Empty:
+        conn = _connect()
+
+    _local.conn = conn
+    _local.generation = generation
+    return conn
+
+
+def release_connection():
+    """Restituisce al pool la connessione del thread corrente (chiamata a fine richiesta)."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        return
+
+    generation = _local.generation
+    _local.conn = None
+
+    # Una transazione rimasta aperta per errore non deve passare alla richiesta successiva
+    if conn.in_transaction:
+        conn.rollback()
+
+    if generation != _generation:
+        conn.close()
+        return
+
+    try:
+        _pool.put_nowait(conn)
+    except Full:
+        conn.close()
+
+
+def close_all():
+    """Chiude tutte le connessioni inattive del pool."""
+    release_connection()
+    _drain(_pool)
+
+
+def _drain(pool):
+    while True:
+        try:
+            pool.get_nowait().close()
+        except Empty:
+            break
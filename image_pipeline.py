@@ -0,0 +1,400 @@
+"""Elaborazione immagini delle performance fuori dal thread della richiesta.
+
+La richiesta salva il file caricato così com'è in RAW_UPLOAD_FOLDER e registra
+la performance con image_status = 'pending'. Un pool di processi decodifica,
+ritaglia e codifica in WebP; al termine lo stato diventa 'ready' (o 'failed').
+
+I file in static/uploads sono indirizzati per contenuto: il nome è l'hash del
+file caricato, quindi lo stesso file caricato due volte viene elaborato una
+volta sola e un nome, una volta scritto, non cambia mai contenuto.
+
+I worker partono con forkserver (spawn dove non esiste, es. Windows) e rieseguono il
+modulo principale: gli script che usano la pipeline devono tenere il codice sotto
+`if __name__ == '__main__':`, oppure impostare IMAGE_WORKERS = 0 (elaborazione in linea).
+"""
+import glob
+import hashlib
+import multiprocessing
+import os
+import secrets
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from PIL import Image
+
+import database
+import performances_dao
+
+IMAGE_STATUS_PENDING = 'pending'
+IMAGE_STATUS_READY = 'ready'
+IMAGE_STATUS_FAILED = 'failed'
+
+TARGET_WIDTH = 450
+TARGET_HEIGHT = 450
+
+# Derivate per srcset: card della home, dettaglio, schermi ad alta densità
+DERIVATIVE_WIDTHS = (200, 400, 800)
+# image_variants di un'immagine elaborata troppo piccola per qualsiasi derivata
+NO_VARIANTS = '-'
+
+# Oltre questa soglia il file è rifiutato prima della decodifica (decompression bomb).
+# Il limite di Pillow (~89 MP) accetta le foto da 48/50 MP, decodificate ridotte con draft()
+MAX_IMAGE_PIXELS = Image.MAX_IMAGE_PIXELS
+ALLOWED_FORMATS = {'JPEG', 'PNG', 'GIF'}
+REDUCIBLE_MODES = {'L', 'LA', 'RGB', 'RGBA', 'CMYK', 'I', 'F'}
+
+HASH_LENGTH = 32  # caratteri esadecimali dello SHA-256 usati nel nome (128 bit)
+CHUNK_SIZE = 64 * 1024
+
+_config = {
+    'upload_folder': 'static/uploads',
+    'raw_folder': 'uploads_raw',
+    'workers': 2,
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+def init_app(app):
+    """Configura cartelle e numero di processi da app.config. IMAGE_WORKERS = 0 elabora in linea."""
+    app.config.setdefault('RAW_UPLOAD_FOLDER', 'uploads_raw')
+    app.config.setdefault('IMAGE_WORKERS', 2)
+
+    _config['upload_folder'] = app.config['UPLOAD_FOLDER']
+    _config['raw_folder'] = app.config['RAW_UPLOAD_FOLDER']
+    _config['workers'] = app.config['IMAGE_WORKERS']
+
+    os.makedirs(_config['raw_folder'], exist_ok=True)
+
+
+def variant_filename(filename, width):
+    """Nome deterministico della derivata: perf_x_123.jpg -> perf_x_123_400w.webp."""
+    stem = os.path.splitext(filename)[0]
+    return f"{stem}_{width}w.webp"
+
+
+def _crop_box(width, height):
+    """Riquadro del ritaglio centrale alla proporzione TARGET_WIDTH:TARGET_HEIGHT."""
+    aspect_ratio = TARGET_WIDTH / TARGET_HEIGHT
+
+    if width / height > aspect_ratio:
+        # Immagine troppo larga
+        new_width = int(height * aspect_ratio)
+        left = (width - new_width) // 2
+        return (left, 0, left + new_width, height)
+
+    # Immagine troppo alta
+    new_height = int(width / aspect_ratio)
+    top = (height - new_height) // 2
+    return (0, top, width, top + new_height)
+
+
+def _load_cropped(source):
+    """Decodifica solo quanto serve: draft JPEG, ritaglio, reduce e infine conversione in RGB."""
+    largest = max(DERIVATIVE_WIDTHS + (TARGET_WIDTH,))
+    largest_height = round(largest * TARGET_HEIGHT / TARGET_WIDTH)
+
+    # Scala minima che lascia un ritaglio di almeno largest x largest_height
+    left, top, right, bottom = _crop_box(*source.size)
+    scale = min(1.0, max(largest / (right - left), largest_height / (bottom - top)))
+    if scale < 1.0:
+        # Solo JPEG: il decoder scala di 1/2, 1/4 o 1/8 (DCT), per gli altri formati è un no-op
+        source.draft('RGB', (int(source.width * scale) + 1, int(source.height * scale) + 1))
+
+    img = source.crop(_crop_box(*source.size))
+
+    # Riduzione intera a box prima del resize LANCZOS finale
+    factor = min(img.width // largest, img.height // largest_height)
+    if factor > 1:
+        if img.mode not in REDUCIBLE_MODES:
+            # Palette e bitmap: reduce non li supporta
+            img = img.convert('RGB')
+        img = img.reduce(factor)
+
+    return img.convert('RGB')
+
+
+def check_image(path):
+    """Legge solo l'intestazione: restituisce un messaggio d'errore o None."""
+    try:
+        with Image.open(path) as img:
+            if img.format not in ALLOWED_FORMATS:
+                return "Formato immagine non supportato"
+            if img.width * img.height > MAX_IMAGE_PIXELS:
+                return f"Immagine troppo grande ({img.width}x{img.height})"
+    except (Image.DecompressionBombError, Image.DecompressionBombWarning):
+        return "Immagine troppo grande"
+    except (OSError, SyntaxError):
+        return "File immagine non leggibile"
+    return None
+
+
+def _save_webp(img, size, path):
+    # Scrittura atomica: il file finale compare solo quando è completo.
+    # Il pid distingue due job concorrenti sullo stesso contenuto
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    img.resize(size, Image.Resampling.LANCZOS).save(tmp_path, "WebP", quality=40, optimize=True)
+    os.replace(tmp_path, path)
+
+
+def _write_derivatives(img, output_path):
+    """Scrive le derivate senza ingrandire la sorgente. Restituisce le larghezze generate."""
+    widths = []
+    for width in DERIVATIVE_WIDTHS:
+        if width > img.width:
+            break
+        height = round(width * TARGET_HEIGHT / TARGET_WIDTH)
+        _save_webp(img, (width, height), variant_filename(output_path, width))
+        widths.append(width)
+    return widths
+
+
+def process_image(raw_path, output_path):
+    """Ritaglio centrale, immagine 450x450 e derivate in WebP. Eseguita nei processi worker.
+    Restituisce le larghezze delle derivate generate."""
+    with Image.open(raw_path) as source:
+        img = _load_cropped(source)
+
+    # Immagine principale per ultima: se esiste, le derivate sono già complete
+    widths = _write_derivatives(img, output_path)
+    _save_webp(img, (TARGET_WIDTH, TARGET_HEIGHT), output_path)
+
+    os.remove(raw_path)
+    return widths
+
+
+def existing_variants(output_path):
+    """Larghezze delle derivate già presenti su disco per un'immagine."""
+    return [width for width in DERIVATIVE_WIDTHS if os.path.exists(variant_filename(output_path, width))]
+
+
+def backfill_image(image_path):
+    """Derivate per un'immagine già in static/uploads. Non ingrandisce: da 450px niente 800w."""
+    with Image.open(image_path) as source:
+        img = _load_cropped(source)
+    return _write_derivatives(img, image_path)
+
+
+def format_variants(widths):
+    """Valore di image_variants. Senza derivate (sorgente più stretta di DERIVATIVE_WIDTHS[0])
+    NO_VARIANTS, non '': l'immagine risulta elaborata e il backfill non la riseleziona."""
+    return ','.join(str(width) for width in widths) or NO_VARIANTS
+
+
+def parse_variants(variants):
+    if not variants or variants == NO_VARIANTS:
+        return []
+    return [int(width) for width in variants.split(',') if width]
+
+
+def store_raw(file):
+    """Salva il file caricato senza elaborarlo, calcolandone l'hash durante la scrittura.
+    Restituisce (nome_file_finale, percorso_grezzo, errore); un file rifiutato viene eliminato."""
+    extension = os.path.splitext(file.filename)[1].lower()
+    digest = hashlib.sha256()
+
+    fd, tmp_path = tempfile.mkstemp(dir=_config['raw_folder'], suffix='.part')
+    with os.fdopen(fd, 'wb') as target:
+        for chunk in iter(lambda: file.stream.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+            target.write(chunk)
+
+    error = check_image(tmp_path)
+    if error:
+        os.remove(tmp_path)
+        return None, None, error
+
+    name = digest.hexdigest()[:HASH_LENGTH]
+    # Il grezzo resta unico per caricamento: due upload identici concorrenti non si pestano
+    raw_path = os.path.join(_config['raw_folder'], f"{name}.{secrets.token_hex(4)}{extension}")
+    os.replace(tmp_path, raw_path)
+    return f"{name}.webp", raw_path, None
+
+
+def _start_method():
+    return 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Niente fork: i worker non ereditano lo stato del processo web
+            # (thread, lock, connessioni SQLite del pool)
+            _executor = ProcessPoolExecutor(max_workers=_config['workers'],
+                                            mp_context=multiprocessing.get_context(_start_method()))
+        return _executor
+
+
+def _finish(performance_id, output_filename, submitter_thread, future):
+    """Callback di completamento: aggiorna lo stato immagine della performance."""
+    variants = ''
+    try:
+        variants = format_variants(future.result())
+        status = IMAGE_STATUS_READY
+    except Exception as e:
+        print(f"Errore elaborazione immagine {output_filename}: {e}")
+        status = IMAGE_STATUS_FAILED
+
+    try:
+        performances_dao.set_image_status(performance_id, output_filename, status, variants)
+    finally:
+        # Di norma il callback gira nel thread di gestione del pool e deve restituire
+        # la connessione; se il job era già concluso gira nel thread della richiesta
+        if threading.get_ident() != submitter_thread:
+            database.release_connection()
+        with _jobs_lock:
+            _jobs.pop(performance_id, None)
+
+
+def submit(performance_id, raw_path, output_filename):
+    """Accoda l'elaborazione e ritorna subito. Restituisce il Future del job."""
+    output_path = os.path.join(_config['upload_folder'], output_filename)
+
+    if os.path.exists(output_path):
+        # Stesso contenuto già elaborato: si riusano immagine e derivate.
+        # Il touch rinnova il periodo di grazia del garbage collector
+        os.remove(raw_path)
+        variants = existing_variants(output_path)
+        for path in [output_path] + [variant_filename(output_path, width) for width in variants]:
+            os.utime(path)
+        future = Future()
+        future.set_result(variants)
+    elif not _config['workers']:
+        # Modalità sincrona (sviluppo/test): stesso percorso, nessun processo esterno
+        future = Future()
+        try:
+            future.set_result(process_image(raw_path, output_path))
+        except Exception as e:
+            future.set_exception(e)
+    else:
+        future = _get_executor().submit(process_image, raw_path, output_path)
+
+    with _jobs_lock:
+        _jobs[performance_id] = future
+    submitter_thread = threading.get_ident()
+    future.add_done_callback(lambda done: _finish(performance_id, output_filename, submitter_thread, done))
+    return future
+
+
+def requeue_pending():
+    """Riaccoda le immagini rimaste 'pending' (es. dopo un riavvio).
+
+    Restituisce {id performance: Future del job}. Un job fallito lascia la performance
+    in stato 'failed'; senza file originale il Future è già concluso con errore.
+    """
+    jobs = {}
+    for performance in performances_dao.get_pending_images():
+        stem = os.path.splitext(performance['performance_image'])[0]
+        raw_files = glob.glob(os.path.join(glob.escape(_config['raw_folder']), glob.escape(stem) + '.*'))
+        if not raw_files:
+            performances_dao.set_image_status(performance['id'], performance['performance_image'],
+                                              IMAGE_STATUS_FAILED)
+            jobs[performance['id']] = future = Future()
+            future.set_exception(FileNotFoundError(f"originale di {performance['performance_image']} "
+                                                   f"non trovato in {_config['raw_folder']}"))
+            continue
+        jobs[performance['id']] = submit(performance['id'], raw_files[0], performance['performance_image'])
+    return jobs
+
+
+def backfill_derivatives():
+    """Genera le derivate per le immagini pronte che non le hanno. Restituisce (generate, fallite)."""
+    performances = performances_dao.get_images_without_variants()
+    paths = [os.path.join(_config['upload_folder'], performance['performance_image'])
+             for performance in performances]
+
+    if _config['workers']:
+        futures = [_get_executor().submit(backfill_image, path) for path in paths]
+    else:
+        futures = []
+        for path in paths:
+            future = Future()
+            try:
+                future.set_result(backfill_image(path))
+            except Exception as e:
+                future.set_exception(e)
+            futures.append(future)
+
+    done = failed = 0
+    for performance, future in zip(performances, futures):
+        try:
+            widths = future.result()
+        except Exception as e:
+            print(f"Errore derivate {performance['performance_image']}: {e}")
+            failed += 1
+            continue
+        performances_dao.set_image_status(performance['id'], performance['performance_image'],
+                                          IMAGE_STATUS_READY, format_variants(widths))
+        done += 1
+    return done, failed
+
+
+def _with_variants(filenames):
+    names = set(filenames)
+    for filename in filenames:
+        names.update(variant_filename(filename, width) for width in DERIVATIVE_WIDTHS)
+    return names
+
+
+def collect_orphans(grace_seconds, dry_run=False):
+    """Elimina i file di static/uploads e RAW_UPLOAD_FOLDER non più referenziati.
+
+    Un file è risparmiato se è stato scritto, o accodato per l'eliminazione,
+    da meno di grace_seconds. Restituisce {'files': [...], 'bytes': n, 'dequeued': n}.
+    """
+    cutoff = time.time() - grace_seconds
+
+    keep = _with_variants(performances_dao.get_referenced_images())
+    queued = performances_dao.get_upload_deletions()
+    # Sostituiti da poco: restano disponibili fino alla fine del periodo di grazia
+    keep |= _with_variants([filename for filename, queued_at in queued.items() if queued_at > cutoff])
+
+    # Grezzi dei job ancora da elaborare
+    pending = {os.path.splitext(performance['performance_image'])[0]
+               for performance in performances_dao.get_pending_images()}
+
+    orphans = []
+    for entry in os.scandir(_config['upload_folder']):
+        if entry.is_file() and entry.name not in keep and entry.stat().st_mtime <= cutoff:
+            orphans.append(entry)
+    for entry in os.scandir(_config['raw_folder']):
+        if entry.is_file() and entry.name.split('.')[0] not in pending and entry.stat().st_mtime <= cutoff:
+            orphans.append(entry)
+
+    report = {'files': [], 'bytes': 0, 'dequeued': 0}
+    for entry in orphans:
+        size = entry.stat().st_size
+        if not dry_run:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+        report['files'].append(entry.path)
+        report['bytes'] += size
+
+    # Voci scadute: il file è stato eliminato qui sopra oppure è di nuovo in uso
+    expired = [filename for filename, queued_at in queued.items() if queued_at <= cutoff]
+    if not dry_run and expired:
+        performances_dao.remove_upload_deletions(expired)
+    report['dequeued'] = len(expired)
+    return report
+
+
+def get_stats():
+    """Job in coda o in esecuzione, per il monitoraggio."""
+    with _jobs_lock:
+        return {'pending_jobs': len(_jobs), 'workers': _config['workers']}
+
+
+def shutdown(wait=True):
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait)
+            _executor = None
@@ -0,0 +1,276 @@
+"""Metriche in formato di testo Prometheus, esposte da /metrics.
+
+- latenza delle richieste per endpoint Flask e status code;
+- durata delle istruzioni SQL per testo normalizzato e funzione chiamante,
+  misurata da un cursore strumentato (execute + fetch, più i commit).
+
+Gli istogrammi sono per processo, come le cache: con più worker ogni processo
+espone i propri e Prometheus li somma per istanza. Sul percorso caldo si paga
+un perf_counter per chiamata e un incremento sotto lock per osservazione.
+"""
+import re
+import sqlite3
+import sys
+import threading
+import time
+from bisect import bisect_left
+
+from flask import g, request
+
+import database
+
+# Limiti superiori dei bucket, in secondi
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5)
+
+# Oltre questo numero di serie le query nuove finiscono sotto query="other"
+MAX_QUERY_SERIES = 500
+
+
+class Histogram:
+    """Istogramma a bucket fissi per combinazione di etichette. Thread-safe."""
+
+    def __init__(self, name, help, labels, buckets, max_series=None):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.max_series = max_series
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                if self.max_series is not None and len(self._series) >= self.max_series:
+                    label_values = ('other',) + label_values[1:]
+                    series = self._series.get(label_values)
+                if series is None:
+                    series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = [(key, list(counts), total) for key, (counts, total) in self._series.items()]
+
+        for label_values, counts, total in sorted(series):
+            labels = _labels(zip(self.labels, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{labels}}} {total!r}')
+            lines.append(f'{self.name}_count{{{labels}}} {cumulative}')
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(pairs):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in pairs)
+
+
+_request_histogram = Histogram('festival_http_request_duration_seconds',
+                               'Tempo di risposta per endpoint e status (esclusa la trasmissione in streaming).',
+                               ('endpoint', 'status'), REQUEST_BUCKETS)
+_query_histogram = Histogram('festival_sql_query_duration_seconds',
+                             'Durata delle istruzioni SQL (execute e fetch) per query normalizzata '
+                             'e funzione chiamante.',
+                             ('query', 'function'), QUERY_BUCKETS, MAX_QUERY_SERIES)
+
+# Testo SQL originale -> normalizzato. I DAO usano poche stringhe fisse, ma si svuota per sicurezza
+_normalized = {}
+MAX_NORMALIZED = 2000
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+
+
+def normalize_query(sql):
+    """Spazi compattati, letterali sostituiti da ?, liste di segnaposto ridotte a (?, ...)."""
+    text = _normalized.get(sql)
+    if text is None:
+        text = ' '.join(sql.split())
+        text = _STRING_LITERAL.sub('?', text)
+        text = _NUMBER_LITERAL.sub('?', text)
+        text = _PLACEHOLDER_LIST.sub('(?, ...)', text)
+        if len(_normalized) >= MAX_NORMALIZED:
+            _normalized.clear()
+        _normalized[sql] = text
+    return text
+
+
+# Oggetto codice -> (nome 'modulo.funzione', è un DAO)
+_functions = {}
+
+
+def _function(frame):
+    code = frame.f_code
+    function = _functions.get(code)
+    if function is None:
+        module = frame.f_globals.get('__name__', '')
+        function = _functions[code] = (f'{module}.{code.co_name}', module.endswith('_dao'), module == __name__)
+    return function
+
+
+def _caller(frame):
+    """Funzione che ha eseguito l'istruzione, es. 'migrations.apply_migrations'. Per i DAO
+    la più esterna della catena: le funzioni di supporto contano per quella pubblica."""
+    while frame is not None:
+        name, is_dao, is_metrics = _function(frame)
+        if not is_metrics:
+            break
+        frame = frame.f_back
+    else:
+        return 'other'
+
+    caller = name
+    while is_dao:
+        caller = name
+        frame = frame.f_back
+        if frame is None:
+            break
+        name, is_dao, _ = _function(frame)
+    return caller
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursore che misura ogni istruzione dall'execute all'ultimo fetch.
+
+    L'osservazione viene registrata alla chiusura del cursore o al successivo execute,
+    quando il tempo di lettura delle righe è noto. Metodi della classe base chiamati
+    direttamente: sul percorso caldo ogni indirezione si paga a ogni query.
+    """
+
+    _statement = None
+    _elapsed = 0.0
+
+    def _flush(self):
+        _query_histogram.observe(self._statement, self._elapsed)
+        self._statement = None
+
+    def execute(self, sql, parameters=()):
+        if self._statement is not None:
+            self._flush()
+        start = time.perf_counter()
+        try:
+            return _cursor_execute(self, sql, parameters)
+        finally:
+            self._elapsed = time.perf_counter() - start
+            self._statement = (normalize_query(sql), _caller(sys._getframe(1)))
+
+    def executemany(self, sql, parameters):
+        if self._statement is not None:
+            self._flush()
+        start = time.perf_counter()
+        try:
+            return _cursor_executemany(self, sql, parameters)
+        finally:
+            self._elapsed = time.perf_counter() - start
+            self._statement = (normalize_query(sql), _caller(sys._getframe(1)))
+
+    def fetchone(self):
+        start = time.perf_counter()
+        try:
+            return _cursor_fetchone(self)
+        finally:
+            self._elapsed += time.perf_counter() - start
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        try:
+            return _cursor_fetchmany(self, self.arraysize if size is None else size)
+        finally:
+            self._elapsed += time.perf_counter() - start
+
+    def fetchall(self):
+        start = time.perf_counter()
+        try:
+            return _cursor_fetchall(self)
+        finally:
+            self._elapsed += time.perf_counter() - start
+
+    def close(self):
+        if self._statement is not None:
+            self._flush()
+        _cursor_close(self)
+
+
+_cursor_execute = sqlite3.Cursor.execute
+_cursor_executemany = sqlite3.Cursor.executemany
+_cursor_fetchone = sqlite3.Cursor.fetchone
+_cursor_fetchmany = sqlite3.Cursor.fetchmany
+_cursor_fetchall = sqlite3.Cursor.fetchall
+_cursor_close = sqlite3.Cursor.close
+
+
+class TimedConnection(sqlite3.Connection):
+    """Connessione che crea TimedCursor e misura anche i commit."""
+
+    def cursor(self, factory=TimedCursor):
+        return sqlite3.Connection.cursor(self, factory)
+
+    def execute(self, sql, parameters=()):
+        # Scorciatoia usata per PRAGMA e DDL: il cursore non viene chiuso, si registra subito
+        start = time.perf_counter()
+        try:
+            return sqlite3.Connection.execute(self, sql, parameters)
+        finally:
+            _query_histogram.observe((normalize_query(sql), _caller(sys._getframe(1))),
+                                     time.perf_counter() - start)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            sqlite3.Connection.commit(self)
+        finally:
+            _query_histogram.observe(('COMMIT', _caller(sys._getframe(1))), time.perf_counter() - start)
+
+
+def init_app(app):
+    """Strumenta richieste e connessioni se METRICS_ENABLED (default: attivo)."""
+    app.config.setdefault('METRICS_ENABLED', True)
+    if not app.config['METRICS_ENABLED']:
+        return
+
+    database.configure(factory=TimedConnection)
+
+    @app.before_request
+    def _start_request_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _observe_request(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            _request_histogram.observe((request.endpoint or 'unmatched', str(response.status_code)),
+                                       time.perf_counter() - start)
+        return response
+
+
+def render(families=()):
+    """Testo di esposizione Prometheus: istogrammi più le famiglie passate.
+
+    families: (nome, tipo, descrizione, [(etichette dict, valore)]), con tipo 'counter' o 'gauge'.
+    """
+    lines = _request_histogram.render() + _query_histogram.render()
+    for name, kind, help, samples in families:
+        lines.append(f'# HELP {name} {help}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in samples:
+            suffix = f'{{{_labels(labels.items())}}}' if labels else ''
+            lines.append(f'{name}{suffix} {value!r}')
+    return '\n'.join(lines) + '\n'
+
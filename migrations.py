@@ -0,0 +1,240 @@
+"""Migrazioni dello schema SQLite, applicate in ordine all'apertura del database.
+
+La versione corrente è salvata in PRAGMA user_version: ogni migrazione viene
+eseguita una sola volta, dentro una transazione, e il numero viene aggiornato
+insieme alle modifiche.
+"""
+
+FESTIVAL_DAYS = ('venerdi', 'sabato', 'domenica')
+
+
+def _001_day_inventory(cursor):
+    """Contatori materializzati dei biglietti venduti per giorno."""
+    cursor.execute('''CREATE TABLE IF NOT EXISTS day_inventory (
+                        day TEXT PRIMARY KEY,
+                        sold INTEGER NOT NULL DEFAULT 0
+                      ) WITHOUT ROWID''')
+
+    for day in FESTIVAL_DAYS:
+        cursor.execute('INSERT OR IGNORE INTO day_inventory (day, sold) VALUES (?, 0)', (day,))
+
+    # Un biglietto conta una volta per ogni giorno presente nel CSV days
+    cursor.execute('''UPDATE day_inventory SET sold = (
+                        SELECT COUNT(*) FROM tickets
+                        WHERE ',' || replace(tickets.days, ' ', '') || ',' LIKE '%,' || day_inventory.day || ',%'
+                      )''')
+
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS tickets_inventory_insert
+                      AFTER INSERT ON tickets
+                      BEGIN
+                        UPDATE day_inventory SET sold = sold + 1
+                        WHERE ',' || replace(NEW.days, ' ', '') || ',' LIKE '%,' || day || ',%';
+                      END''')
+
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS tickets_inventory_delete
+                      AFTER DELETE ON tickets
+                      BEGIN
+                        UPDATE day_inventory SET sold = sold - 1
+                        WHERE ',' || replace(OLD.days, ' ', '') || ',' LIKE '%,' || day || ',%';
+                      END''')
+
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS tickets_inventory_update
+                      AFTER UPDATE OF days ON tickets
+                      BEGIN
+                        UPDATE day_inventory SET sold = sold - 1
+                        WHERE ',' || replace(OLD.days, ' ', '') || ',' LIKE '%,' || day || ',%';
+                        UPDATE day_inventory SET sold = sold + 1
+                        WHERE ',' || replace(NEW.days, ' ', '') || ',' LIKE '%,' || day || ',%';
+                      END''')
+
+
+def _002_ticket_days(cursor):
+    """Giorni coperti da ogni biglietto in una relazione indicizzata al posto del CSV."""
+    cursor.execute('''CREATE TABLE IF NOT EXISTS ticket_days (
+                        ticket_id INTEGER NOT NULL,
+                        day TEXT NOT NULL,
+                        PRIMARY KEY (ticket_id, day),
+                        FOREIGN KEY (ticket_id) REFERENCES tickets (id) ON DELETE CASCADE
+                      ) WITHOUT ROWID''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ticket_days_day ON ticket_days(day, ticket_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tickets_user ON tickets(user_id)')
+
+    # Backfill dal CSV esistente: day_inventory fa da calendario dei giorni validi
+    cursor.execute('''INSERT OR IGNORE INTO ticket_days (ticket_id, day)
+                      SELECT t.id, d.day
+                      FROM tickets t
+                      JOIN day_inventory d
+                        ON ',' || replace(t.days, ' ', '') || ',' LIKE '%,' || d.day || ',%'
+                      ''')
+
+    # I contatori ora seguono ticket_days, che a sua volta segue tickets
+    for trigger in ('tickets_inventory_insert', 'tickets_inventory_delete', 'tickets_inventory_update'):
+        cursor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS tickets_days_insert
+                      AFTER INSERT ON tickets
+                      BEGIN
+                        INSERT OR IGNORE INTO ticket_days (ticket_id, day)
+                        SELECT NEW.id, day FROM day_inventory
+                        WHERE ',' || replace(NEW.days, ' ', '') || ',' LIKE '%,' || day || ',%';
+                      END''')
+
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS tickets_days_delete
+                      AFTER DELETE ON tickets
+                      BEGIN
+                        DELETE FROM ticket_days WHERE ticket_id = OLD.id;
+                      END''')
+
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS tickets_days_update
+                      AFTER UPDATE OF days ON tickets
+                      BEGIN
+                        DELETE FROM ticket_days WHERE ticket_id = OLD.id;
+                        INSERT OR IGNORE INTO ticket_days (ticket_id, day)
+                        SELECT NEW.id, day FROM day_inventory
+                        WHERE ',' || replace(NEW.days, ' ', '') || ',' LIKE '%,' || day || ',%';
+                      END''')
+
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS ticket_days_inventory_insert
+                      AFTER INSERT ON ticket_days
+                      BEGIN
+                        UPDATE day_inventory SET sold = sold + 1 WHERE day = NEW.day;
+                      END''')
+
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS ticket_days_inventory_delete
+                      AFTER DELETE ON ticket_days
+                      BEGIN
+                        UPDATE day_inventory SET sold = sold - 1 WHERE day = OLD.day;
+                      END''')
+
+    # Riallinea i contatori alla nuova sorgente
+    cursor.execute('''UPDATE day_inventory SET sold = (
+                        SELECT COUNT(*) FROM ticket_days WHERE ticket_days.day = day_inventory.day
+                      )''')
+
+
+def _003_schedule_keyset_indexes(cursor):
+    """Indici nell'ordine di paginazione keyset di programma e liste organizzatore."""
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_performances_schedule
+                      ON performances(published, day, start_time, id)''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_performances_organizer
+                      ON performances(organizer_id, published, day, start_time, id)''')
+
+
+def _004_performances_fts(cursor):
+    """Indice full-text FTS5 su artista e descrizione, sincronizzato da trigger."""
+    # Tabella external content: il testo resta in performances, l'indice usa rowid = id.
+    # prefix='2 3' precalcola i prefissi brevi per le ricerche "parola*".
+    cursor.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS performances_fts USING fts5(
+                        artist_name, description,
+                        content='performances', content_rowid='id',
+                        tokenize='unicode61 remove_diacritics 2',
+                        prefix='2 3'
+                      )''')
+    cursor.execute("INSERT INTO performances_fts(performances_fts) VALUES ('rebuild')")
+
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS performances_fts_insert
+                      AFTER INSERT ON performances
+                      BEGIN
+                        INSERT INTO performances_fts (rowid, artist_name, description)
+                        VALUES (NEW.id, NEW.artist_name, NEW.description);
+                      END''')
+
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS performances_fts_delete
+                      AFTER DELETE ON performances
+                      BEGIN
+                        INSERT INTO performances_fts (performances_fts, rowid, artist_name, description)
+                        VALUES ('delete', OLD.id, OLD.artist_name, OLD.description);
+                      END''')
+
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS performances_fts_update
+                      AFTER UPDATE OF artist_name, description ON performances
+                      BEGIN
+                        INSERT INTO performances_fts (performances_fts, rowid, artist_name, description)
+                        VALUES ('delete', OLD.id, OLD.artist_name, OLD.description);
+                        INSERT INTO performances_fts (rowid, artist_name, description)
+                        VALUES (NEW.id, NEW.artist_name, NEW.description);
+                      END''')
+
+
+def _005_image_status(cursor):
+    """Stato dell'elaborazione immagine: le immagini esistenti sono già pronte."""
+    cursor.execute("ALTER TABLE performances ADD COLUMN image_status TEXT NOT NULL DEFAULT 'ready'")
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_performances_image_status
+                      ON performances(image_status) WHERE image_status != 'ready'
+                      ''')
+
+
+def _006_image_variants(cursor):
+    """Larghezze delle derivate generate per il srcset, separate da virgola."""
+    cursor.execute("ALTER TABLE performances ADD COLUMN image_variants TEXT NOT NULL DEFAULT ''")
+
+
+def _007_upload_deletions(cursor):
+    """Coda di eliminazione differita: le immagini sostituite o di performance eliminate."""
+    cursor.execute('''CREATE TABLE IF NOT EXISTS upload_deletions (
+                          filename TEXT PRIMARY KEY,
+                          queued_at INTEGER NOT NULL
+                      ) WITHOUT ROWID''')
+
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS performances_image_replaced
+                      AFTER UPDATE OF performance_image ON performances
+                      WHEN OLD.performance_image != '' AND OLD.performance_image IS NOT NEW.performance_image
+                      BEGIN
+                        INSERT OR REPLACE INTO upload_deletions (filename, queued_at)
+                        VALUES (OLD.performance_image, CAST(strftime('%s', 'now') AS INTEGER));
+                      END''')
+
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS performances_image_deleted
+                      AFTER DELETE ON performances
+                      WHEN OLD.performance_image != ''
+                      BEGIN
+                        INSERT OR REPLACE INTO upload_deletions (filename, queued_at)
+                        VALUES (OLD.performance_image, CAST(strftime('%s', 'now') AS INTEGER));
+                      END''')
+
+
+def _008_schedule_version(cursor):
+    """Versione del programma condivisa tra i processi: una riga, incrementata nella
+    stessa transazione di ogni modifica al programma."""
+    cursor.execute('''CREATE TABLE IF NOT EXISTS schedule_version (
+                          id INTEGER PRIMARY KEY CHECK (id = 1),
+                          version INTEGER NOT NULL
+                      )''')
+    cursor.execute('INSERT OR IGNORE INTO schedule_version (id, version) VALUES (1, 0)')
+
+
+# Ordine di applicazione: la posizione (partendo da 1) è il numero di versione
+MIGRATIONS = [
+    _001_day_inventory,
+    _002_ticket_days,
+    _003_schedule_keyset_indexes,
+    _004_performances_fts,
+    _005_image_status,
+    _006_image_variants,
+    _007_upload_deletions,
+    _008_schedule_version,
+]
+
+
+def apply_migrations(conn):
+    """Porta il database all'ultima versione. Sicura con più processi concorrenti."""
+    for version, migration in enumerate(MIGRATIONS, start=1):
+        if conn.execute('PRAGMA user_version').fetchone()[0] >= version:
+            continue
+
+        cursor = conn.cursor()
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            # Riletta sotto lock: un altro processo potrebbe averla già applicata
+            if cursor.execute('PRAGMA user_version').fetchone()[0] >= version:
+                conn.rollback()
+                continue
+
+            migration(cursor)
+            cursor.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
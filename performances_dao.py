@@ -1,18 +1,133 @@
+import hashlib
+import re
 import sqlite3
-from datetime import datetime, timedelta
 
-def get_published_performances(day_filter='', stage_filter='', genre_filter=''):
-    """Recupera performance pubblicate con filtri opzionali."""
+import database
+from cache import LRUCache
+from schedule_index import ScheduleIndex
+
+# Risultati filtrati di get_published_performances, chiave (versione, giorno, palco, genere)
+_schedule_cache = LRUCache(maxsize=256)
+
+# Slot pubblicati per (palco, giorno): controllo conflitti senza query
+_schedule_index = ScheduleIndex()
+
+def get_schedule_version():
+    """Versione corrente del programma, condivisa tra i processi (tabella schedule_version).
     
-    # Query con JOIN ottimizzato per performance
-    query = '''SELECT p.id, p.artist_name, p.description, p.day, p.start_time, 
-                      p.duration, p.genre, p.performance_image, s.name as stage_name
-               FROM performances p 
-               JOIN stages s ON p.stage_id = s.id
-               WHERE p.published = 1'''
-    params = []
+    Le chiavi di cache e gli ETag la includono: una modifica fatta da un worker
+    invalida i risultati di tutti gli altri alla lettura successiva."""
+    conn = database.get_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT version FROM schedule_version WHERE id = 1')
+    version = cursor.fetchone()[0]
+    cursor.close()
+    return version
+
+# Sale degli ETag: identifica il deploy (impostato dall'app con set_etag_salt), così
+# worker diversi e riavvii dello stesso codice producono gli stessi ETag
+_etag_salt = ''
+
+def set_etag_salt(salt):
+    global _etag_salt
+    _etag_salt = salt
+
+def schedule_etag(*parts, version=None):
+    """ETag di una risposta derivata dal programma: deploy, versione e le parti che la
+    distinguono (URL, utente, host...). Passare version se già letta per la chiave di cache."""
+    if version is None:
+        version = get_schedule_version()
+    key = '|'.join([_etag_salt, str(version)] + [str(part) for part in parts])
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+def _bump_schedule_version(cursor):
+    """Incrementa la versione dentro la transazione della modifica, prima del commit.
+    Restituisce la nuova versione."""
+    cursor.execute('UPDATE schedule_version SET version = version + 1 WHERE id = 1')
+    cursor.execute('SELECT version FROM schedule_version WHERE id = 1')
+    return cursor.fetchone()[0]
+
+def get_schedule_cache_stats():
+    """Hit/miss della cache del programma, per il monitoraggio."""
+    return _schedule_cache.stats()
+
+# Paginazione keyset: (colonna SQL, chiave nella riga, conversione del valore nel cursore)
+PAGE_SIZE = 24
+SCHEDULE_ORDER = [('p.day', 'day', str), ('p.start_time', 'start_time', str), ('p.id', 'id', int)]
+ORGANIZER_ORDER = [('p.published', 'published', int)] + SCHEDULE_ORDER
+
+def _encode_cursor(row, order_by):
+    return '|'.join(str(row[key]) for _, key, _ in order_by)
+
+def _decode_cursor(cursor, order_by):
+    """Cursore 'valore|valore|...' nei tipi delle colonne. None se assente o non valido."""
+    if not cursor:
+        return None
+    
+    parts = cursor.split('|')
+    if len(parts) != len(order_by):
+        return None
+    
+    try:
+        return [convert(part) for part, (_, _, convert) in zip(parts, order_by)]
+    except ValueError:
+        return None
+
+def _fetch_page(query, params, order_by, after=None, before=None, limit=PAGE_SIZE):
+    """Esegue query come pagina keyset. Il costo non dipende dalla profondità della pagina:
+    il confronto sul row value parte dall'indice invece di scartare righe con OFFSET."""
+    columns = ', '.join(column for column, _, _ in order_by)
+    placeholders = ', '.join('?' for _ in order_by)
+    
+    after_values = _decode_cursor(after, order_by)
+    before_values = _decode_cursor(before, order_by) if after_values is None else None
+    params = list(params)
+    
+    if after_values:
+        query += f' AND ({columns}) > ({placeholders})'
+        params.extend(after_values)
+    elif before_values:
+        query += f' AND ({columns}) < ({placeholders})'
+        params.extend(before_values)
+    
+    # Pagina precedente: si legge all'indietro e si ribalta il risultato
+    direction = 'DESC' if before_values else 'ASC'
+    query += ' ORDER BY ' + ', '.join(f'{column} {direction}' for column, _, _ in order_by)
+    query += ' LIMIT ?'
+    params.append(limit + 1)
+    
+    conn = database.get_connection()
+    cursor = conn.cursor()
+    cursor.execute(query, params)
+    
+    rows = cursor.fetchall()
+    
+    cursor.close()
+    
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if before_values:
+        rows.reverse()
+    
+    next_cursor = prev_cursor = None
+    if rows:
+        if before_values:
+            next_cursor = _encode_cursor(rows[-1], order_by)
+            prev_cursor = _encode_cursor(rows[0], order_by) if has_more else None
+        else:
+            next_cursor = _encode_cursor(rows[-1], order_by) if has_more else None
+            prev_cursor = _encode_cursor(rows[0], order_by) if after_values else None
+    
+    return {
+        'performances': rows,
+        'next_cursor': next_cursor,
+        'prev_cursor': prev_cursor
+    }
+
+def _add_schedule_filters(query, params, day_filter, stage_filter, genre_filter):
+    """Aggiunge i filtri giorno/palco/genere (alias p e s) come prepared statement."""
+    params = list(params)
     
-    # Costruzione dinamica con prepared statements
     if day_filter:
         query += ' AND p.day = ?'
         params.append(day_filter)
@@ -25,19 +140,134 @@ def get_published_performances(day_filter='', stage_filter='', genre_filter=''):
         query += ' AND p.genre = ?'
         params.append(genre_filter)
     
-    # Ordinamento cronologico con limite per performance
-    query += ''' ORDER BY p.day ASC, p.start_time ASC LIMIT 50'''
+    return query, params
+
+def get_published_performances(day_filter='', stage_filter='', genre_filter='',
+                               after=None, before=None, limit=PAGE_SIZE):
+    """Recupera una pagina di performance pubblicate con filtri opzionali.
+    
+    Restituisce {'performances', 'next_cursor', 'prev_cursor'}; i cursori vanno
+    ripassati come after/before. Pagine in cache fino al prossimo cambio di programma.
+    """
+    cache_key = (get_schedule_version(), day_filter, stage_filter, genre_filter, after, before, limit)
+    page = _schedule_cache.get(cache_key)
+    if page is not None:
+        return page
+    
+    # Query con JOIN ottimizzato per performance
+    query = '''SELECT p.id, p.artist_name, p.description, p.day, p.start_time, 
+                      p.duration, p.genre, p.performance_image, p.image_status, p.image_variants,
+                      s.name as stage_name
+               FROM performances p 
+               JOIN stages s ON p.stage_id = s.id
+               WHERE p.published = 1'''
+    query, params = _add_schedule_filters(query, [], day_filter, stage_filter, genre_filter)
+    
+    # Ordinamento cronologico (day, start_time, id) paginato a keyset
+    page = _fetch_page(query, params, SCHEDULE_ORDER, after, before, limit)
     
-    conn = sqlite3.connect('db/festival.db')
-    conn.row_factory = sqlite3.Row
+    _schedule_cache.set(cache_key, page)
+    return page
+
+# Colonne esposte dall'API JSON: niente organizzatore né stato interno
+API_COLUMNS = '''p.id, p.artist_name, p.description, p.day, p.start_time, p.duration,
+                 p.genre, p.performance_image, s.name as stage_name'''
+
+def iter_published_performances(day_filter='', stage_filter='', genre_filter='', batch_size=100):
+    """Generatore sulle performance pubblicate in ordine cronologico, a blocchi di batch_size righe."""
+    query = f'''SELECT {API_COLUMNS}
+                FROM performances p
+                JOIN stages s ON p.stage_id = s.id
+                WHERE p.published = 1'''
+    query, params = _add_schedule_filters(query, [], _normalize_day(day_filter), stage_filter, genre_filter)
+    query += ' ORDER BY p.day, p.start_time, p.id'
+    
+    return _iter_rows(query, params, batch_size)
+
+def iter_schedule_export(day_filter='', stage_filter='', batch_size=100):
+    """Generatore per l'export iCalendar/CSV: orario di fine calcolato, anche oltre la mezzanotte."""
+    query = '''SELECT p.id, p.artist_name, p.description, p.genre, p.day, p.start_time, p.duration,
+                      datetime(p.day || ' ' || p.start_time, '+' || p.duration || ' minutes') AS end_at,
+                      s.name AS stage_name
+               FROM performances p
+               JOIN stages s ON p.stage_id = s.id
+               WHERE p.published = 1'''
+    query, params = _add_schedule_filters(query, [], _normalize_day(day_filter), stage_filter, '')
+    query += ' ORDER BY p.day, p.start_time, p.id'
+    
+    return _iter_rows(query, params, batch_size)
+
+def _iter_rows(query, params, batch_size):
+    """Righe una alla volta, lette dal cursore a blocchi di batch_size."""
+    conn = database.get_connection()
     cursor = conn.cursor()
-    cursor.execute(query, params)
     
-    performances = cursor.fetchall()
+    try:
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        cursor.close()
+
+def get_published_performance(performance_id):
+    """Singola performance pubblicata con le colonne dell'API, o None."""
+    query = f'''SELECT {API_COLUMNS}
+                FROM performances p
+                JOIN stages s ON p.stage_id = s.id
+                WHERE p.id = ? AND p.published = 1'''
+    
+    conn = database.get_connection()
+    cursor = conn.cursor()
+    cursor.execute(query, (performance_id,))
+    
+    performance = cursor.fetchone()
     
     cursor.close()
-    conn.close()
-    return performances
+    return performance
+
+SEARCH_LIMIT = 50
+
+def _fts_query(text):
+    """Trasforma il testo libero in una query FTS5 sicura: ogni parola come prefisso, in AND."""
+    words = re.findall(r'\w+', text or '')
+    return ' '.join(f'"{word}"*' for word in words)
+
+def search_performances(text, day_filter='', stage_filter='', genre_filter='', limit=SEARCH_LIMIT):
+    """Ricerca full-text su artista e descrizione tra le performance pubblicate.
+    
+    Usa l'indice FTS5 con ranking bm25 (artista pesa più della descrizione)
+    e si combina con gli stessi filtri di get_published_performances.
+    """
+    match = _fts_query(text)
+    if not match:
+        return []
+    
+    query = '''SELECT p.id, p.artist_name, p.description, p.day, p.start_time, 
+                      p.duration, p.genre, p.performance_image, p.image_status, p.image_variants,
+                      s.name as stage_name
+               FROM performances_fts f
+               JOIN performances p ON p.id = f.rowid
+               JOIN stages s ON p.stage_id = s.id
+               WHERE performances_fts MATCH ? AND p.published = 1'''
+    query, params = _add_schedule_filters(query, [match], day_filter, stage_filter, genre_filter)
+    
+    query += ' ORDER BY bm25(performances_fts, 10.0, 1.0), p.day, p.start_time LIMIT ?'
+    params.append(limit)
+    
+    conn = database.get_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute(query, params)
+        return cursor.fetchall()
+    except sqlite3.Error as e:
+        print(f"Errore ricerca: {e}")
+        return []
+    finally:
+        cursor.close()
 
 def get_performance(performance_id):
     """Recupera singola performance con dati organizzatore."""
@@ -46,45 +276,32 @@ def get_performance(performance_id):
              JOIN users u ON p.organizer_id = u.id 
              WHERE p.id = ?'''
     
-    conn = sqlite3.connect('db/festival.db')
-    conn.row_factory = sqlite3.Row
+    conn = database.get_connection()
     cursor = conn.cursor()
     cursor.execute(sql, (performance_id,))
     
     performance = cursor.fetchone()
     
     cursor.close()
-    conn.close()
     return performance
 
-def get_organizer_performances(organizer_id):
-    """Recupera performance di un organizzatore. Bozze prima, poi cronologico."""
+def get_organizer_performances(organizer_id, after=None, before=None, limit=PAGE_SIZE):
+    """Recupera una pagina di performance di un organizzatore. Bozze prima, poi cronologico."""
     sql = '''SELECT p.*, s.name as stage_name 
              FROM performances p 
              JOIN stages s ON p.stage_id = s.id 
-             WHERE p.organizer_id = ?
-             ORDER BY 
-                p.published ASC,    -- Bozze prima (0 < 1)
-                p.day ASC,
-                p.start_time ASC'''
-    
-    conn = sqlite3.connect('db/festival.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute(sql, (organizer_id,))
+             WHERE p.organizer_id = ?'''
     
-    performances = cursor.fetchall()
-    
-    cursor.close()
-    conn.close()
-    return performances
+    # Bozze prima (0 < 1), poi (day, start_time, id)
+    return _fetch_page(sql, [organizer_id], ORGANIZER_ORDER, after, before, limit)
 
 def add_performance(performance_data):
-    """Inserisce nuova performance. Normalizza i giorni in formato ISO."""
+    """Inserisce nuova performance. Normalizza i giorni in formato ISO.
+    Restituisce l'id della nuova performance, False in caso di errore."""
     sql = '''INSERT INTO performances 
              (artist_name, day, start_time, duration, description, stage_id, genre, 
-              performance_image, organizer_id, published)
-             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+              performance_image, image_status, organizer_id, published)
+             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
     
     day = performance_data['day']
     
@@ -98,7 +315,7 @@ def add_performance(performance_data):
     if day in day_mapping:
         day = day_mapping[day]
     
-    conn = sqlite3.connect('db/festival.db')
+    conn = database.get_connection()
     cursor = conn.cursor()
     
     try:
@@ -106,14 +323,15 @@ def add_performance(performance_data):
                            performance_data['start_time'], performance_data['duration'],
                            performance_data['description'], performance_data['stage_id'],
                            performance_data['genre'], performance_data.get('performance_image', ''),
+                           performance_data.get('image_status', 'ready'),
                            performance_data['organizer_id'], performance_data['published']))
         conn.commit()
-        return True
+        return cursor.lastrowid
     except sqlite3.Error:
+        conn.rollback()
         return False
     finally:
         cursor.close()
-        conn.close()
 
 def update_performance(performance_data):
     """Aggiorna performance. Due query: con/senza immagine per ottimizzare."""
@@ -129,7 +347,7 @@ def update_performance(performance_data):
     if day in day_mapping:
         day = day_mapping[day]
     
-    conn = sqlite3.connect('db/festival.db')
+    conn = database.get_connection()
     cursor = conn.cursor()
     
     try:
@@ -137,12 +355,13 @@ def update_performance(performance_data):
         if 'performance_image' in performance_data and performance_data['performance_image']:
             sql = '''UPDATE performances SET 
                      artist_name=?, day=?, start_time=?, duration=?, description=?, 
-                     stage_id=?, genre=?, performance_image=?
+                     stage_id=?, genre=?, performance_image=?, image_status=?, image_variants=''
                      WHERE id=?'''
             cursor.execute(sql, (performance_data['artist_name'], day,
                                performance_data['start_time'], performance_data['duration'],
                                performance_data['description'], performance_data['stage_id'],
                                performance_data['genre'], performance_data['performance_image'],
+                               performance_data.get('image_status', 'ready'),
                                performance_data['id']))
         else:
             # Preserva immagine esistente
@@ -154,21 +373,164 @@ def update_performance(performance_data):
                                performance_data['start_time'], performance_data['duration'],
                                performance_data['description'], performance_data['stage_id'],
                                performance_data['genre'], performance_data['id']))
+        _bump_schedule_version(cursor)
         conn.commit()
         return True
     except sqlite3.Error:
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+
+def _normalize_day(day):
+    """Accetta sia il nome del giorno sia la data ISO usata in tabella."""
+    day_mapping = {
+        'venerdi': '2025-07-12',
+        'sabato': '2025-07-13',
+        'domenica': '2025-07-14'
+    }
+    return day_mapping.get(day, day)
+
+def _load_schedule_index(cursor, version):
+    cursor.execute('''SELECT id, stage_id, day, start_time, duration
+                      FROM performances WHERE published = 1''')
+    _schedule_index.load(cursor.fetchall(), version)
+
+def _sync_schedule_index(cursor):
+    """Indice degli slot pubblicati, ricaricato se la versione del programma in tabella è cambiata.
+    
+    La versione cambia a ogni pubblicazione, modifica o eliminazione, fatta da qualsiasi
+    processo: il controllo costa una lettura per chiave primaria."""
+    cursor.execute('SELECT version FROM schedule_version WHERE id = 1')
+    version = cursor.fetchone()[0]
+    if _schedule_index.version != version:
+        _load_schedule_index(cursor, version)
+    return _schedule_index
+
+def _get_schedule_index():
+    """Come _sync_schedule_index, con una connessione del pool (controlli fuori transazione)."""
+    conn = database.get_connection()
+    cursor = conn.cursor()
+    try:
+        return _sync_schedule_index(cursor)
+    finally:
+        cursor.close()
+
+def get_schedule_index_stats():
+    """Dimensione e versione dell'indice degli slot, per il monitoraggio."""
+    return {'loaded': _schedule_index.loaded, 'slots': _schedule_index.size,
+            'version': _schedule_index.version}
+
+def set_image_status(performance_id, performance_image, status, variants=''):
+    """Aggiorna stato e derivate dell'immagine se la performance usa ancora quel file."""
+    sql = '''UPDATE performances SET image_status = ?, image_variants = ?
+             WHERE id = ? AND performance_image = ?'''
+    
+    conn = database.get_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute(sql, (status, variants, performance_id, performance_image))
+        updated = cursor.rowcount > 0
+        if updated:
+            cursor.execute('SELECT published FROM performances WHERE id = ?', (performance_id,))
+            if cursor.fetchone()[0]:
+                # Cambia il rendering delle card (placeholder -> immagine, srcset); per le
+                # bozze no: non compaiono in programma, export e API
+                _bump_schedule_version(cursor)
+        conn.commit()
+        return updated
+    except sqlite3.Error:
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+
+def get_pending_images():
+    """Performance con immagine ancora da elaborare (indice parziale su image_status)."""
+    sql = "SELECT id, performance_image FROM performances WHERE image_status = 'pending'"
+    
+    conn = database.get_connection()
+    cursor = conn.cursor()
+    cursor.execute(sql)
+    
+    performances = cursor.fetchall()
+    
+    cursor.close()
+    return performances
+
+def get_images_without_variants():
+    """Immagini pronte mai passate per le derivate (caricate prima del srcset).
+    
+    Quelle troppo piccole per qualsiasi derivata hanno image_variants = NO_VARIANTS ('-')
+    e non ricompaiono."""
+    sql = '''SELECT id, performance_image FROM performances
+             WHERE performance_image IS NOT NULL AND performance_image != ''
+               AND image_status = 'ready' AND image_variants = ''
+          '''
+    
+    conn = database.get_connection()
+    cursor = conn.cursor()
+    cursor.execute(sql)
+    
+    performances = cursor.fetchall()
+    
+    cursor.close()
+    return performances
+
+def get_referenced_images():
+    """Nomi dei file in static/uploads ancora usati dal database."""
+    conn = database.get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute("SELECT DISTINCT performance_image FROM performances WHERE performance_image != ''")
+    referenced = {row[0] for row in cursor.fetchall() if row[0]}
+    
+    # Immagini profilo: solo se lo schema le prevede
+    cursor.execute('PRAGMA table_info(users)')
+    if any(column['name'] == 'profile_image' for column in cursor.fetchall()):
+        cursor.execute("SELECT DISTINCT profile_image FROM users WHERE profile_image != ''")
+        referenced.update(row[0] for row in cursor.fetchall() if row[0])
+    
+    cursor.close()
+    return referenced
+
+def get_upload_deletions():
+    """Coda di eliminazione differita: {nome_file: timestamp di accodamento}."""
+    conn = database.get_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT filename, queued_at FROM upload_deletions')
+    
+    queued = {row['filename']: row['queued_at'] for row in cursor.fetchall()}
+    
+    cursor.close()
+    return queued
+
+def remove_upload_deletions(filenames):
+    """Toglie dalla coda i file già trattati."""
+    conn = database.get_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.executemany('DELETE FROM upload_deletions WHERE filename = ?',
+                           [(filename,) for filename in filenames])
+        conn.commit()
+        return True
+    except sqlite3.Error:
+        conn.rollback()
         return False
     finally:
         cursor.close()
-        conn.close()
 
 def publish_performance(performance_id):
     """Pubblica performance dopo controllo conflitti orari."""
-    conn = sqlite3.connect('db/festival.db')
-    conn.row_factory = sqlite3.Row
+    conn = database.get_connection()
     cursor = conn.cursor()
     
     try:
+        # Lock di scrittura: controllo conflitti e pubblicazione non si intercalano con altre pubblicazioni
+        cursor.execute('BEGIN IMMEDIATE')
+        
         # Recupera dati per controllo conflitti
         sql = '''SELECT day, start_time, duration, stage_id, artist_name
                  FROM performances 
@@ -177,12 +539,16 @@ def publish_performance(performance_id):
         performance = cursor.fetchone()
         
         if not performance:
+            conn.rollback()
             return False
         
         day, start_time, duration, stage_id, artist_name = performance
         
         # Verifica conflitti con performance pubblicate
-        if check_conflict(stage_id, day, start_time, duration):
+        index = _sync_schedule_index(cursor)
+        index_version = index.version
+        if index.find_conflict(stage_id, day, start_time, duration) is not None:
+            conn.rollback()
             print(f"Impossibile pubblicare {artist_name}: conflitto orario")
             return False
         
@@ -191,93 +557,150 @@ def publish_performance(performance_id):
                         SET published = 1
                         WHERE id = ?'''
         cursor.execute(sql_update, (performance_id,))
+        version = _bump_schedule_version(cursor)
         
         conn.commit()
+        index.extend([(performance_id, stage_id, day, start_time, duration)], index_version, version)
         return True
         
     except Exception as e:
+        conn.rollback()
         print(f"Errore pubblicazione: {e}")
         return False
     finally:
         cursor.close()
-        conn.close()
 
-def check_conflict(stage_id, day, start_time, duration):
-    """Verifica sovrapposizioni orarie sullo stesso palco."""
-    conn = sqlite3.connect('db/festival.db')
-    conn.row_factory = sqlite3.Row
+def publish_performances(performance_ids, organizer_id):
+    """Pubblica in blocco le bozze indicate in un'unica transazione di scrittura.
+    
+    Le bozze sono validate contro il programma pubblicato e tra loro; viene
+    pubblicato tutto l'insieme senza conflitti. Restituisce un report per id:
+    {'status': 'published' | 'conflict' | 'missing_image' | 'image_not_ready' | 'not_found',
+     'artist_name': ..., 'conflict_with': id o None}.
+    """
+    ids = sorted({int(performance_id) for performance_id in performance_ids})
+    report = {performance_id: {'status': 'not_found', 'artist_name': None, 'conflict_with': None}
+              for performance_id in ids}
+    if not ids:
+        return report
+    
+    placeholders = ', '.join('?' for _ in ids)
+    
+    conn = database.get_connection()
     cursor = conn.cursor()
     
-    # Calcolo orario fine per logica sovrapposizione
-    start_datetime = datetime.strptime(start_time, "%H:%M")
-    end_datetime = start_datetime + timedelta(minutes=int(duration))
-    end_time = end_datetime.strftime("%H:%M")
-    
-    # Logica sovrapposizione: due performance NON si sovrappongono se una finisce prima che inizi l'altra
-    sql = '''SELECT * FROM performances 
-             WHERE stage_id = ? AND day = ? AND published = 1 AND
-             NOT (? >= time(start_time, '+' || duration || ' minutes') OR 
-                  ? <= start_time)'''
-    
-    cursor.execute(sql, (stage_id, day, start_time, end_time))
-    conflicts = cursor.fetchall()
-    
-    cursor.close()
-    conn.close()
-    return len(conflicts) > 0
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        
+        # Solo bozze dell'organizzatore richiedente
+        cursor.execute(f'''SELECT id, day, start_time, duration, stage_id, artist_name,
+                                   performance_image, image_status
+                            FROM performances
+                            WHERE id IN ({placeholders}) AND organizer_id = ? AND published = 0''',
+                       (*ids, organizer_id))
+        drafts = []
+        for row in cursor.fetchall():
+            report[row['id']]['artist_name'] = row['artist_name']
+            # Immagine obbligatoria per la pubblicazione
+            if not row['performance_image']:
+                report[row['id']]['status'] = 'missing_image'
+                continue
+            # ...e già elaborata dal worker immagini
+            if row['image_status'] != 'ready':
+                report[row['id']]['status'] = 'image_not_ready'
+                continue
+            drafts.append(dict(row))
+        
+        # Un solo passaggio sull'indice per tutte le bozze
+        index = _sync_schedule_index(cursor)
+        index_version = index.version
+        conflicts = index.validate_batch(drafts)
+        
+        to_publish = []
+        for draft in drafts:
+            conflict = conflicts[draft['id']]
+            if conflict is None:
+                report[draft['id']]['status'] = 'published'
+                to_publish.append(draft)
+            else:
+                report[draft['id']]['status'] = 'conflict'
+                report[draft['id']]['conflict_with'] = conflict[1]
+        
+        if not to_publish:
+            conn.rollback()
+            return report
+        
+        publish_placeholders = ', '.join('?' for _ in to_publish)
+        cursor.execute(f'UPDATE performances SET published = 1 WHERE id IN ({publish_placeholders})',
+                       [draft['id'] for draft in to_publish])
+        version = _bump_schedule_version(cursor)
+        
+        conn.commit()
+        
+        index.extend([(draft['id'], draft['stage_id'], draft['day'], draft['start_time'], draft['duration'])
+                      for draft in to_publish], index_version, version)
+        return report
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"Errore pubblicazione multipla: {e}")
+        for entry in report.values():
+            if entry['status'] == 'published':
+                entry['status'] = 'error'
+        return report
+    finally:
+        cursor.close()
+
+def check_conflict(stage_id, day, start_time, duration):
+    """Verifica sovrapposizioni orarie sullo stesso palco (ricerca O(log n) sull'indice in memoria)."""
+    index = _get_schedule_index()
+    return index.find_conflict(stage_id, _normalize_day(day), start_time, duration) is not None
 
 def check_conflict_exclude(stage_id, day, start_time, duration, exclude_id):
     """Come check_conflict ma esclude performance specifica (per modifiche)."""
-    conn = sqlite3.connect('db/festival.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    start_datetime = datetime.strptime(start_time, "%H:%M")
-    end_datetime = start_datetime + timedelta(minutes=int(duration))
-    end_time = end_datetime.strftime("%H:%M")
-    
-    # Stessa logica con esclusione per ID
-    sql = '''SELECT * FROM performances 
-             WHERE stage_id = ? AND day = ? AND published = 1 AND id != ? AND
-             NOT (? >= time(start_time, '+' || duration || ' minutes') OR 
-                  ? <= start_time)'''
-    
-    cursor.execute(sql, (stage_id, day, exclude_id, start_time, end_time))
-    conflicts = cursor.fetchall()
-    
-    cursor.close()
-    conn.close()
-    return len(conflicts) > 0
+    index = _get_schedule_index()
+    return index.find_conflict(stage_id, _normalize_day(day), start_time, duration,
+                               exclude_id=int(exclude_id)) is not None
+
+def validate_schedule(slots):
+    """Valida un insieme di slot bozza contro il programma pubblicato e tra loro.
+    
+    slots: dict con id, stage_id, day, start_time, duration.
+    Restituisce {id: None | ('published', id_conflitto) | ('batch', id_conflitto)}.
+    """
+    normalized = [dict(slot, day=_normalize_day(slot['day'])) for slot in slots]
+    return _get_schedule_index().validate_batch(normalized)
 
 def artist_exists(artist_name):
     """Verifica unicità artista (regola business: un artista = una performance)."""
     sql = 'SELECT * FROM performances WHERE artist_name = ?'
     
-    conn = sqlite3.connect('db/festival.db')
-    conn.row_factory = sqlite3.Row
+    conn = database.get_connection()
     cursor = conn.cursor()
     cursor.execute(sql, (artist_name,))
     
     artist = cursor.fetchone()
     
     cursor.close()
-    conn.close()
     return artist is not None
 
 def delete_performance(performance_id):
     """Elimina solo bozze (published=0) per proteggere programma pubblicato."""
     sql = 'DELETE FROM performances WHERE id = ? AND published = 0'
     
-    conn = sqlite3.connect('db/festival.db')
+    conn = database.get_connection()
     cursor = conn.cursor()
     
     try:
         cursor.execute(sql, (performance_id,))
-        conn.commit()
         # rowcount > 0 = eliminazione avvenuta
-        return cursor.rowcount > 0
+        deleted = cursor.rowcount > 0
+        if deleted:
+            _bump_schedule_version(cursor)
+        conn.commit()
+        return deleted
     except sqlite3.Error:
+        conn.rollback()
         return False
     finally:
-        cursor.close()
-        conn.close()
\ No newline at end of file
+        cursor.close()
\ No newline at end of file
@@ -0,0 +1,106 @@
+"""Export del programma pubblicato in iCalendar (RFC 5545) e CSV, una riga alla volta."""
+import csv
+import io
+from datetime import datetime, timezone
+
+from flask import url_for
+
+CALENDAR_NAME = "Madness Festival 2025"
+TIMEZONE = "Europe/Rome"
+
+# Regole ora legale/solare dell'Europa centrale, necessarie per DTSTART;TZID=Europe/Rome
+VTIMEZONE = [
+    "BEGIN:VTIMEZONE",
+    f"TZID:{TIMEZONE}",
+    "BEGIN:DAYLIGHT",
+    "TZOFFSETFROM:+0100",
+    "TZOFFSETTO:+0200",
+    "TZNAME:CEST",
+    "DTSTART:19700329T020000",
+    "RRULE:FREQ=YEARLY;BYMONTH=3;BYDAY=-1SU",
+    "END:DAYLIGHT",
+    "BEGIN:STANDARD",
+    "TZOFFSETFROM:+0200",
+    "TZOFFSETTO:+0100",
+    "TZNAME:CET",
+    "DTSTART:19701025T030000",
+    "RRULE:FREQ=YEARLY;BYMONTH=10;BYDAY=-1SU",
+    "END:STANDARD",
+    "END:VTIMEZONE",
+]
+
+CSV_HEADER = ['id', 'artista', 'giorno', 'inizio', 'fine', 'durata_minuti', 'palco', 'genere', 'url']
+
+
+def _ics_text(value):
+    """Escape dei valori TEXT: backslash, punto e virgola, virgola e a capo."""
+    return (value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def _ics_line(line):
+    """Riga terminata da CRLF, spezzata a 75 ottetti senza tagliare caratteri UTF-8."""
+    chunks = []
+    current = ''
+    for char in line:
+        limit = 75 if not chunks else 74  # le continuazioni iniziano con uno spazio
+        if len((current + char).encode('utf-8')) > limit:
+            chunks.append(current)
+            current = ''
+        current += char
+    chunks.append(current)
+    return '\r\n '.join(chunks) + '\r\n'
+
+
+def _ics_datetime(day, time):
+    return day.replace('-', '') + 'T' + time.replace(':', '')[:4] + '00'
+
+
+def iter_ics(rows, location):
+    """Documento iCalendar a pezzi: intestazione, un VEVENT per riga, chiusura."""
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+    header = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//Madness Festival//Programma//IT",
+              "CALSCALE:GREGORIAN", "METHOD:PUBLISH", f"X-WR-CALNAME:{CALENDAR_NAME}",
+              f"X-WR-TIMEZONE:{TIMEZONE}"] + VTIMEZONE
+    yield ''.join(_ics_line(line) for line in header)
+
+    for row in rows:
+        end_day, end_time = row['end_at'].split(' ')
+        event = [
+            "BEGIN:VEVENT",
+            f"UID:performance-{row['id']}@madnessfestival",
+            f"DTSTAMP:{stamp}",
+            f"DTSTART;TZID={TIMEZONE}:{_ics_datetime(row['day'], row['start_time'])}",
+            f"DTEND;TZID={TIMEZONE}:{_ics_datetime(end_day, end_time)}",
+            f"SUMMARY:{_ics_text(row['artist_name'])}",
+            f"DESCRIPTION:{_ics_text(row['description'] or '')}",
+            f"LOCATION:{_ics_text(row['stage_name'] + ' - ' + location)}",
+            f"CATEGORIES:{_ics_text(row['genre'])}",
+            f"URL:{url_for('performance_detail', id=row['id'], _external=True)}",
+            "END:VEVENT",
+        ]
+        yield ''.join(_ics_line(line) for line in event)
+
+    yield _ics_line("END:VCALENDAR")
+
+
+def iter_csv(rows):
+    """CSV a pezzi: intestazione e una riga per performance."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return data
+
+    writer.writerow(CSV_HEADER)
+    yield flush()
+
+    for row in rows:
+        writer.writerow([row['id'], row['artist_name'], row['day'], row['start_time'],
+                         row['end_at'][11:16], row['duration'], row['stage_name'], row['genre'],
+                         url_for('performance_detail', id=row['id'], _external=True)])
+        yield flush()
@@ -0,0 +1,144 @@
+import bisect
+import threading
+
+
+def to_minutes(time_str):
+    """'HH:MM' -> minuti dalla mezzanotte."""
+    hours, minutes = time_str.split(':')[:2]
+    return int(hours) * 60 + int(minutes)
+
+
+class _StageDaySlots:
+    """Slot di un palco in un giorno, ordinati per inizio.
+
+    max_end[i] è la fine massima tra gli slot 0..i: permette di fermare la
+    ricerca all'indietro appena nessuno slot precedente può più sovrapporsi.
+    """
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.ids = []
+        self.max_end = []
+
+    def add(self, start, end, performance_id):
+        position = bisect.bisect_right(self.starts, start)
+        self.starts.insert(position, start)
+        self.ends.insert(position, end)
+        self.ids.insert(position, performance_id)
+        self.max_end.insert(position, 0)
+
+        # Ricalcola i massimi dalla posizione di inserimento in poi
+        running = self.max_end[position - 1] if position else 0
+        for i in range(position, len(self.ends)):
+            running = max(running, self.ends[i])
+            self.max_end[i] = running
+
+    def find_overlap(self, start, end, exclude_id=None):
+        """Primo slot che si sovrappone a [start, end), o None. O(log n) con slot disgiunti."""
+        # Solo gli slot che iniziano prima della fine richiesta possono sovrapporsi
+        i = bisect.bisect_left(self.starts, end) - 1
+
+        while i >= 0 and self.max_end[i] > start:
+            if self.ends[i] > start and self.ids[i] != exclude_id:
+                return self.ids[i]
+            i -= 1
+
+        return None
+
+
+class ScheduleIndex:
+    """Indice in memoria degli slot pubblicati, per (palco, giorno). Thread-safe."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._slots = None
+        self.size = 0
+        # Versione del programma (tabella schedule_version) a cui l'indice è aggiornato
+        self.version = None
+
+    @property
+    def loaded(self):
+        return self._slots is not None
+
+    def load(self, rows, version=None):
+        """Ricostruisce l'indice da righe (id, stage_id, day, start_time, duration)."""
+        slots = {}
+        for performance_id, stage_id, day, start_time, duration in rows:
+            start = to_minutes(start_time)
+            key = (int(stage_id), day)
+            slots.setdefault(key, _StageDaySlots()).add(start, start + int(duration), performance_id)
+
+        with self._lock:
+            self._slots = slots
+            self.size = len(rows)
+            self.version = version
+
+    def invalidate(self):
+        with self._lock:
+            self._slots = None
+            self.size = 0
+            self.version = None
+
+    def add(self, performance_id, stage_id, day, start_time, duration):
+        """Registra uno slot appena pubblicato."""
+        start = to_minutes(start_time)
+        with self._lock:
+            key = (int(stage_id), day)
+            self._slots.setdefault(key, _StageDaySlots()).add(start, start + int(duration), performance_id)
+            self.size += 1
+
+    def extend(self, rows, from_version, to_version):
+        """Aggiunge gli slot appena pubblicati e passa a to_version, se l'indice è ancora a
+        from_version. Altrimenti non fa nulla: è già stato ricaricato o lo sarà al prossimo uso."""
+        with self._lock:
+            if self._slots is None or self.version != from_version:
+                return
+            for performance_id, stage_id, day, start_time, duration in rows:
+                self.add(performance_id, stage_id, day, start_time, duration)
+            self.version = to_version
+
+    def find_conflict(self, stage_id, day, start_time, duration, exclude_id=None):
+        """ID della performance pubblicata in conflitto, o None."""
+        start = to_minutes(start_time)
+        with self._lock:
+            slots = self._slots.get((int(stage_id), day))
+            if slots is None:
+                return None
+            return slots.find_overlap(start, start + int(duration), exclude_id)
+
+    def validate_batch(self, candidates):
+        """Valida un insieme di slot contro il programma e tra loro in un solo passaggio.
+
+        candidates: dict con id, stage_id, day, start_time, duration.
+        Gli slot sono considerati in ordine cronologico: il primo di due slot
+        sovrapposti viene accettato, il successivo scartato.
+        Restituisce {id: None | ('published', id_conflitto) | ('batch', id_conflitto)}.
+        """
+        ordered = sorted(candidates, key=lambda slot: (int(slot['stage_id']), slot['day'],
+                                                      to_minutes(slot['start_time']), slot['id']))
+        report = {}
+        accepted = {}
+
+        with self._lock:
+            for slot in ordered:
+                key = (int(slot['stage_id']), slot['day'])
+                start = to_minutes(slot['start_time'])
+                end = start + int(slot['duration'])
+
+                published = self._slots.get(key)
+                conflict = published.find_overlap(start, end, slot['id']) if published else None
+                if conflict is not None:
+                    report[slot['id']] = ('published', conflict)
+                    continue
+
+                # Sweep per (palco, giorno): basta confrontare la fine massima già accettata
+                last_end, last_id = accepted.get(key, (0, None))
+                if last_id is not None and start < last_end:
+                    report[slot['id']] = ('batch', last_id)
+                    continue
+
+                accepted[key] = (max(last_end, end), slot['id'] if end >= last_end else last_id)
+                report[slot['id']] = None
+
+        return report
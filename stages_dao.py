@@ -1,21 +1,32 @@
-import sqlite3
+import database
+from cache import LRUCache
+
+# I palchi non vengono modificati dall'applicazione: l'elenco resta valido per tutto il processo
+_stages_cache = LRUCache(maxsize=1)
+
+def get_stages_cache_stats():
+    """Hit/miss della cache dei palchi, per il monitoraggio."""
+    return _stages_cache.stats()
 
 def get_all_stages():
     """Recupera tutti i palchi ordinati alfabeticamente per interfaccia utente."""
+    stages = _stages_cache.get('all')
+    if stages is not None:
+        return stages
+    
     query = '''SELECT id, name, capacity, description, created_at
                FROM stages
                ORDER BY name'''
     
-    conn = sqlite3.connect('db/festival.db')
-    conn.row_factory = sqlite3.Row
+    conn = database.get_connection()
     cursor = conn.cursor()
     cursor.execute(query)
     
     stages = cursor.fetchall()
     
     cursor.close()
-    conn.close()
     
+    _stages_cache.set('all', stages)
     return stages
 
 
@@ -25,14 +36,12 @@ def get_stage_by_name(name):
                FROM stages
                WHERE name = ?'''
     
-    conn = sqlite3.connect('db/festival.db')
-    conn.row_factory = sqlite3.Row
+    conn = database.get_connection()
     cursor = conn.cursor()
     cursor.execute(query, (name,))
     
     stage = cursor.fetchone()
     
     cursor.close()
-    conn.close()
     
     return stage
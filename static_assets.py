@@ -0,0 +1,163 @@
+"""File statici con URL fingerprint e varianti precompresse.
+
+Ogni url_for('static', ...) riceve ?v=<hash del contenuto>: l'URL cambia quando
+cambia il file, quindi la risposta può essere messa in cache per un anno con
+Cache-Control: immutable. CSS e JS vengono compressi in anticipo (flask
+build-assets) in .gz e, se il modulo brotli è installato, .br.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+
+from flask import request, send_from_directory
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # opzionale: senza, solo gzip
+    brotli = None
+
+FINGERPRINT_LENGTH = 12
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg')
+# Cartelle con contenuti caricati dagli utenti: niente precompressione
+SKIP_FOLDERS = ('uploads',)
+
+# Ordine di preferenza se il client accetta entrambe
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+_fingerprints = {}
+_fingerprints_lock = threading.Lock()
+
+
+def fingerprint(static_folder, filename):
+    """Hash breve del contenuto, ricalcolato solo se cambia mtime o dimensione."""
+    path = safe_join(static_folder, filename)
+    if path is None:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    key = (stat.st_mtime_ns, stat.st_size)
+    with _fingerprints_lock:
+        cached = _fingerprints.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(64 * 1024), b''):
+            digest.update(chunk)
+    value = digest.hexdigest()[:FINGERPRINT_LENGTH]
+
+    with _fingerprints_lock:
+        _fingerprints[path] = (key, value)
+    return value
+
+
+def deploy_fingerprint(app):
+    """Hash di moduli Python, template e file statici dell'app (escluse le cartelle di upload).
+
+    Uguale in tutti i worker e tra i riavvii finché non cambia il codice distribuito.
+    """
+    sources = [(app.root_path, name) for name in sorted(os.listdir(app.root_path)) if name.endswith('.py')]
+    for folder in (app.template_folder and os.path.join(app.root_path, app.template_folder), app.static_folder):
+        if not folder or not os.path.isdir(folder):
+            continue
+        for root, subfolders, files in os.walk(folder):
+            subfolders[:] = sorted(name for name in subfolders if name not in SKIP_FOLDERS)
+            # Le varianti precompresse derivano dagli originali
+            sources.extend((folder, os.path.relpath(os.path.join(root, name), folder))
+                           for name in sorted(files) if not name.endswith(('.gz', '.br', '.tmp')))
+
+    digest = hashlib.sha256()
+    for folder, name in sources:
+        digest.update(f"{os.path.basename(folder)}/{name}={fingerprint(folder, name)}\n".encode())
+    return digest.hexdigest()[:FINGERPRINT_LENGTH]
+
+
+def build(static_folder):
+    """Scrive le varianti .gz/.br dei file comprimibili. Restituisce [(file, originale, gz, br)]."""
+    results = []
+    for root, folders, files in os.walk(static_folder):
+        folders[:] = [folder for folder in folders if folder not in SKIP_FOLDERS]
+        for name in files:
+            if not name.endswith(COMPRESSIBLE_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            with open(path, 'rb') as source:
+                data = source.read()
+
+            _write_atomic(path + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+            br_size = None
+            if brotli is not None:
+                _write_atomic(path + '.br', brotli.compress(data, quality=11))
+                br_size = os.path.getsize(path + '.br')
+
+            results.append((os.path.relpath(path, static_folder), len(data),
+                            os.path.getsize(path + '.gz'), br_size))
+    return results
+
+
+def _write_atomic(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as target:
+        target.write(data)
+    os.replace(tmp_path, path)
+
+
+def _precompressed(static_folder, filename):
+    """Variante precompressa accettata dal client e non più vecchia dell'originale, o None."""
+    path = safe_join(static_folder, filename)
+    if path is None:
+        return None
+    for encoding, extension in ENCODINGS:
+        if not request.accept_encodings[encoding]:
+            continue
+        try:
+            if os.path.getmtime(path + extension) >= os.path.getmtime(path):
+                return encoding, filename + extension
+        except OSError:
+            continue
+    return None
+
+
+def init_app(app):
+    """Fingerprint negli URL statici, header di cache e servizio delle varianti compresse."""
+    static_folder = app.static_folder
+    serve_static = app.view_functions['static']
+
+    @app.url_defaults
+    def add_fingerprint(endpoint, values):
+        if endpoint == 'static' and 'v' not in values:
+            version = fingerprint(static_folder, values.get('filename', ''))
+            if version:
+                values['v'] = version
+
+    def static_view(filename):
+        if filename.endswith(COMPRESSIBLE_EXTENSIONS):
+            variant = _precompressed(static_folder, filename)
+            if variant:
+                encoding, compressed = variant
+                response = send_from_directory(static_folder, compressed,
+                                               mimetype=mimetypes.guess_type(filename)[0])
+                response.headers['Content-Encoding'] = encoding
+            else:
+                response = serve_static(filename=filename)
+            response.vary.add('Accept-Encoding')
+        else:
+            response = serve_static(filename=filename)
+
+        # URL con fingerprint corretto: il contenuto a questo URL non cambierà mai
+        if request.args.get('v') and request.args['v'] == fingerprint(static_folder, filename):
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+            response.cache_control.no_cache = None
+        return response
+
+    app.view_functions['static'] = static_view
@@ -0,0 +1,123 @@
+"""Limitazione dei tentativi di login e registrazione.
+
+Due difese contro le raffiche di credenziali, che costano CPU per via degli hash
+delle password:
+- finestre scorrevoli per IP e per email: oltre il limite si risponde 429;
+- un tetto alle operazioni di hash concorrenti: se i posti sono occupati la
+  richiesta viene rifiutata subito con 429 invece di restare in coda.
+
+L'IP è request.remote_addr: dietro un proxy inverso va impostato TRUSTED_PROXY_COUNT
+nell'app, altrimenti tutti i client condividerebbero l'indirizzo del proxy.
+
+I contatori stanno in un MemoryStore per processo. Con più worker si può passare
+in THROTTLE_STORE un oggetto condiviso (es. su Redis) con lo stesso metodo hit().
+"""
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+# (tentativi, finestra in secondi)
+DEFAULT_LIMITS = {
+    'login_ip': (10, 60),
+    'login_email': (10, 300),
+    'register_ip': (5, 3600),
+}
+DEFAULT_HASH_CONCURRENCY = 4
+
+
+class Throttled(Exception):
+    """Richiesta rifiutata: riprovare dopo retry_after secondi."""
+
+    def __init__(self, retry_after):
+        super().__init__(retry_after)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class MemoryStore:
+    """Log scorrevole dei tentativi per chiave, in memoria. Thread-safe.
+
+    Ogni chiave conserva al massimo `limit` timestamp; oltre max_keys chiavi
+    vengono scartate quelle usate meno di recente.
+    """
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._logs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key, limit, window, now=None):
+        """Registra un tentativo. Restituisce 0 se ammesso, altrimenti i secondi di attesa."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            log = self._logs.get(key)
+            if log is None:
+                log = self._logs[key] = deque()
+            self._logs.move_to_end(key)
+
+            while log and log[0] <= now - window:
+                log.popleft()
+
+            if len(log) >= limit:
+                return log[0] + window - now
+
+            log.append(now)
+            while len(self._logs) > self.max_keys:
+                self._logs.popitem(last=False)
+            return 0
+
+    def clear(self):
+        with self._lock:
+            self._logs.clear()
+
+
+_config = {
+    'limits': dict(DEFAULT_LIMITS),
+    'store': MemoryStore(),
+}
+_hash_slots = threading.BoundedSemaphore(DEFAULT_HASH_CONCURRENCY)
+_stats = {'throttled': 0, 'shed': 0}
+_stats_lock = threading.Lock()
+
+
+def init_app(app):
+    """Configura limiti, archivio dei contatori e posti per gli hash da app.config."""
+    global _hash_slots
+
+    for name, default in DEFAULT_LIMITS.items():
+        _config['limits'][name] = app.config.get(f'THROTTLE_{name.upper()}', default)
+    _config['store'] = app.config.get('THROTTLE_STORE') or MemoryStore()
+    _hash_slots = threading.BoundedSemaphore(app.config.get('HASH_CONCURRENCY', DEFAULT_HASH_CONCURRENCY))
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def check(limit_name, value):
+    """Conta un tentativo per (limite, valore); solleva Throttled oltre il limite."""
+    limit, window = _config['limits'][limit_name]
+    retry_after = _config['store'].hit(f'{limit_name}:{value}', limit, window)
+    if retry_after > 0:
+        _count('throttled')
+        raise Throttled(retry_after)
+
+
+@contextmanager
+def hash_slot():
+    """Posto per un'operazione di hash della password: se non ce ne sono, 429 subito."""
+    if not _hash_slots.acquire(blocking=False):
+        _count('shed')
+        raise Throttled(1)
+    try:
+        yield
+    finally:
+        _hash_slots.release()
+
+
+def get_stats():
+    """Richieste rifiutate per limite superato (throttled) e per hash saturi (shed)."""
+    with _stats_lock:
+        return dict(_stats)
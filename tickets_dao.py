@@ -1,21 +1,27 @@
 import sqlite3
 from datetime import datetime
 
+import database
+
 MAX_DAILY_CAPACITY = 200  # Capacità massima giornaliera del festival
 
+# Esiti possibili di purchase_ticket
+PURCHASE_SUCCESS = 'success'
+PURCHASE_SOLD_OUT = 'sold_out'
+PURCHASE_RULE_VIOLATION = 'rule_violation'
+PURCHASE_ERROR = 'error'
+
 def get_user_tickets(user_id):
     """Recupera tutti i biglietti di un utente. Usato nel profilo partecipante."""
     sql = 'SELECT * FROM tickets WHERE user_id = ?'
     
-    conn = sqlite3.connect('db/festival.db')
-    conn.row_factory = sqlite3.Row
+    conn = database.get_connection()
     cursor = conn.cursor()
     cursor.execute(sql, (user_id,))
     
     tickets = cursor.fetchall()
     
     cursor.close()
-    conn.close()
     
     return tickets
 
@@ -24,8 +30,11 @@ def add_ticket(ticket_data):
     sql = '''INSERT INTO tickets (user_id, ticket_type, days, price, purchase_date)
              VALUES (?, ?, ?, ?, ?)'''
     
+    conn = database.get_connection()
+    
     try:
-        with sqlite3.connect('db/festival.db') as conn:
+        # Il context manager fa commit o rollback sulla connessione condivisa
+        with conn:
             cursor = conn.cursor()
             
             cursor.execute(sql, (
@@ -35,7 +44,6 @@ def add_ticket(ticket_data):
                 ticket_data['price'], 
                 ticket_data['purchase_date']
             ))
-            conn.commit()
             return True
     except sqlite3.Error as e:
         print(f"Errore DB add_ticket: {e}")
@@ -44,6 +52,29 @@ def add_ticket(ticket_data):
         print(f"Errore generale add_ticket: {e}")
         return False
 
+def _read_inventory(cursor):
+    """Legge i contatori materializzati di day_inventory (tre righe, lettura per chiave)."""
+    day_counts = {'venerdi': 0, 'sabato': 0, 'domenica': 0}
+    
+    cursor.execute('SELECT day, sold FROM day_inventory')
+    for day, sold in cursor.fetchall():
+        if day in day_counts:
+            day_counts[day] = sold
+    
+    return day_counts
+
+def _count_sold_by_day(cursor):
+    """Conta i biglietti per giorno da ticket_days. Sorgente per statistiche e riconciliazione."""
+    day_counts = {'venerdi': 0, 'sabato': 0, 'domenica': 0}
+    
+    # Aggregato sull'indice (day, ticket_id): nessuna lettura della tabella tickets
+    cursor.execute('SELECT day, COUNT(*) FROM ticket_days GROUP BY day')
+    for day, sold in cursor.fetchall():
+        if day in day_counts:
+            day_counts[day] = sold
+    
+    return day_counts
+
 def get_daily_availability():
     """Calcola posti disponibili per giorno. Ogni biglietto conta una volta per giorno."""
     # Inizializza capacità massima
@@ -53,162 +84,330 @@ def get_daily_availability():
         'domenica': MAX_DAILY_CAPACITY
     }
     
+    conn = database.get_connection()
+    cursor = conn.cursor()
+    
     try:
-        conn = sqlite3.connect('db/festival.db')
-        cursor = conn.cursor()
-        
-        # Recupera tutti i biglietti con giorni validi
-        cursor.execute('SELECT ticket_type, days FROM tickets WHERE days IS NOT NULL AND days != ""')
-        tickets = cursor.fetchall()
-        
-        # Conteggio per giorno (ogni biglietto conta una volta per giorno coperto)
-        day_counts = {'venerdi': 0, 'sabato': 0, 'domenica': 0}
-        
-        for ticket_type, days in tickets:
-            if not days:
-                continue
-                
-            # Dividi giorni CSV e incrementa contatori
-            ticket_days = [day.strip() for day in days.split(',')]
-            for day in ticket_days:
-                if day in day_counts:
-                    day_counts[day] += 1
+        day_counts = _read_inventory(cursor)
         
         # Calcola disponibilità residua
         for day in availability:
             sold = day_counts[day]
             availability[day] = max(0, MAX_DAILY_CAPACITY - sold)
-            
-        # Debug per monitoraggio vendite
-        print(f"DEBUG availability - Venduti: {day_counts}")
-        print(f"DEBUG availability - Disponibili: {availability}")
                     
     except sqlite3.Error as e:
         print(f"Errore calcolo disponibilità: {e}")
     finally:
         cursor.close()
-        conn.close()
     
     return availability
 
-def check_availability(ticket_type, selected_days):
-    """Verifica disponibilità biglietti per tipo specifico."""
-    availability = get_daily_availability()
-    
+def _days_available(availability, ticket_type, selected_days):
+    """Verifica che i giorni richiesti abbiano posti liberi per il tipo di biglietto."""
     if ticket_type == 'daily':
         if len(selected_days) != 1:
             return False
         day = selected_days[0]
-        result = day in availability and availability[day] > 0
-        return result
+        return day in availability and availability[day] > 0
     
     elif ticket_type == '2days':
         if len(selected_days) != 2:
             return False
-        result = all(day in availability and availability[day] > 0 for day in selected_days)
-        return result
+        return all(day in availability and availability[day] > 0 for day in selected_days)
     
     elif ticket_type == 'full':
         required_days = ['venerdi', 'sabato', 'domenica']
-        result = all(availability.get(day, 0) > 0 for day in required_days)
-        return result
+        return all(availability.get(day, 0) > 0 for day in required_days)
     
     return False
 
+def check_availability(ticket_type, selected_days):
+    """Verifica disponibilità biglietti per tipo specifico."""
+    availability = get_daily_availability()
+    return _days_available(availability, ticket_type, selected_days)
+
+def _check_purchase_rules(cursor, user_id, ticket_type, selected_days):
+    """Applica le regole business di acquisto usando il cursore fornito."""
+    # Validazioni specifiche per tipo biglietto
+    if ticket_type == 'daily':
+        if len(selected_days) == 0:
+            return False, "Seleziona almeno un giorno per il biglietto giornaliero."
+        elif len(selected_days) > 1:
+            return False, "Per il biglietto giornaliero puoi selezionare un solo giorno."
+    elif ticket_type == '2days':
+        if len(selected_days) != 2:
+            return False, "Per il pass 2 giorni devi selezionare esattamente 2 giorni."
+    
+    # Recupera biglietti esistenti dell'utente
+    cursor.execute('SELECT ticket_type FROM tickets WHERE user_id = ?', (user_id,))
+    existing_tickets = cursor.fetchall()
+    
+    if not existing_tickets:
+        return True, "OK"
+    
+    # Verifica pass multi-giorno esistenti
+    has_multi_day = any(ticket[0] in ['2days', 'full'] for ticket in existing_tickets)
+    
+    if has_multi_day:
+        return False, "Hai già un pass multi-giorno. Non puoi acquistare altri biglietti."
+    
+    # Impedisce acquisto pass se ha biglietti giornalieri
+    if ticket_type in ['2days', 'full'] and existing_tickets:
+        return False, "Hai già biglietti giornalieri. Non puoi acquistare un pass multi-giorno."
+    
+    # Per biglietti giornalieri: verifica conflitti giorni (lookup indicizzato su ticket_days)
+    if ticket_type == 'daily':
+        placeholders = ', '.join('?' for _ in selected_days)
+        cursor.execute(f'''SELECT td.day
+                           FROM tickets t
+                           JOIN ticket_days td ON td.ticket_id = t.id
+                           WHERE t.user_id = ? AND td.day IN ({placeholders})
+                           LIMIT 1''', (user_id, *selected_days))
+        conflict = cursor.fetchone()
+        
+        if conflict:
+            day = conflict[0]
+            day_names = {'venerdi': 'Venerdì', 'sabato': 'Sabato', 'domenica': 'Domenica'}
+            return False, f"Hai già un biglietto per {day_names.get(day, day)}."
+        
+        return True, "OK"
+    
+    return True, "OK"
+
 def can_purchase_ticket(user_id, ticket_type, selected_days):
     """Valida regole business acquisto biglietti. Previene conflitti e duplicati."""
-    conn = sqlite3.connect('db/festival.db')
-    conn.row_factory = sqlite3.Row
+    conn = database.get_connection()
     cursor = conn.cursor()
     
     try:
-        # Validazioni specifiche per tipo biglietto
-        if ticket_type == 'daily':
-            if len(selected_days) == 0:
-                return False, "Seleziona almeno un giorno per il biglietto giornaliero."
-            elif len(selected_days) > 1:
-                return False, "Per il biglietto giornaliero puoi selezionare un solo giorno."
-        elif ticket_type == '2days':
-            if len(selected_days) != 2:
-                return False, "Per il pass 2 giorni devi selezionare esattamente 2 giorni."
+        return _check_purchase_rules(cursor, user_id, ticket_type, selected_days)
         
-        # Recupera biglietti esistenti dell'utente
-        cursor.execute('SELECT ticket_type, days FROM tickets WHERE user_id = ?', (user_id,))
-        existing_tickets = cursor.fetchall()
+    except Exception as e:
+        print(f"Errore validazione acquisto: {e}")
+        return False, "Errore durante la verifica"
+    finally:
+        cursor.close()
+
+def purchase_ticket(ticket_data):
+    """Acquisto atomico: disponibilità, regole utente e inserimento in un'unica transazione.
+    
+    BEGIN IMMEDIATE prende subito il lock di scrittura, quindi due acquisti concorrenti
+    vengono serializzati e nessuno dei due può leggere una disponibilità già superata.
+    Restituisce (esito, messaggio) con esito tra le costanti PURCHASE_*.
+    """
+    selected_days = [day.strip() for day in ticket_data['days'].split(',') if day.strip()]
+    ticket_type = ticket_data['ticket_type']
+    
+    sql = '''INSERT INTO tickets (user_id, ticket_type, days, price, purchase_date)
+             VALUES (?, ?, ?, ?, ?)'''
+    
+    conn = database.get_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
         
-        if not existing_tickets:
-            return True, "OK"
+        # Capacità residua letta sotto lock (i trigger aggiornano day_inventory all'INSERT)
+        day_counts = _read_inventory(cursor)
+        availability = {day: MAX_DAILY_CAPACITY - sold for day, sold in day_counts.items()}
+        if not _days_available(availability, ticket_type, selected_days):
+            conn.rollback()
+            return PURCHASE_SOLD_OUT, "Biglietti non disponibili per le date selezionate"
         
-        # Verifica pass multi-giorno esistenti
-        has_multi_day = any(ticket[0] in ['2days', 'full'] for ticket in existing_tickets)
+        # Regole per utente (doppio acquisto, pass multi-giorno, giorni coperti)
+        allowed, message = _check_purchase_rules(cursor, ticket_data['user_id'], ticket_type, selected_days)
+        if not allowed:
+            conn.rollback()
+            return PURCHASE_RULE_VIOLATION, message
         
-        if has_multi_day:
-            return False, "Hai già un pass multi-giorno. Non puoi acquistare altri biglietti."
+        cursor.execute(sql, (
+            ticket_data['user_id'],
+            ticket_type,
+            ticket_data['days'],
+            ticket_data['price'],
+            ticket_data['purchase_date']
+        ))
+        conn.commit()
+        return PURCHASE_SUCCESS, "OK"
         
-        # Impedisce acquisto pass se ha biglietti giornalieri
-        if ticket_type in ['2days', 'full'] and existing_tickets:
-            return False, "Hai già biglietti giornalieri. Non puoi acquistare un pass multi-giorno."
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"Errore DB purchase_ticket: {e}")
+        return PURCHASE_ERROR, "Errore durante l'acquisto del biglietto"
+    finally:
+        cursor.close()
+
+def get_purchase_context(user_id):
+    """Stato completo per la pagina /buy_ticket con una sola query.
+    
+    Le righe di day_inventory (ticket_id NULL) e quelle dei biglietti dell'utente
+    arrivano insieme in un UNION ALL; il lookup per utente usa idx_tickets_user.
+    """
+    sql = '''SELECT day, sold, NULL AS id, NULL AS ticket_type, NULL AS days,
+                    NULL AS price, NULL AS purchase_date
+             FROM day_inventory
+             UNION ALL
+             SELECT td.day, NULL, t.id, t.ticket_type, t.days, t.price, t.purchase_date
+             FROM tickets t
+             LEFT JOIN ticket_days td ON td.ticket_id = t.id
+             WHERE t.user_id = ?'''
+    
+    availability = {
+        'venerdi': MAX_DAILY_CAPACITY,
+        'sabato': MAX_DAILY_CAPACITY, 
+        'domenica': MAX_DAILY_CAPACITY
+    }
+    covered_days = set()
+    tickets = {}
+    
+    conn = database.get_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute(sql, (user_id,))
         
-        # Per biglietti giornalieri: verifica conflitti giorni
-        if ticket_type == 'daily':
-            existing_days = set()
-            for ticket in existing_tickets:
-                if ticket[1]:  # Campo days non vuoto
-                    existing_days.update(ticket[1].split(','))
-            
-            # Controlla sovrapposizioni per giorno selezionato
-            for day in selected_days:
-                if day in existing_days:
-                    day_names = {'venerdi': 'Venerdì', 'sabato': 'Sabato', 'domenica': 'Domenica'}
-                    return False, f"Hai già un biglietto per {day_names.get(day, day)}."
+        for row in cursor.fetchall():
+            if row['id'] is None:
+                # Riga contatore giornaliero
+                if row['day'] in availability:
+                    availability[row['day']] = max(0, MAX_DAILY_CAPACITY - row['sold'])
+                continue
             
-            return True, "OK"
+            # Riga biglietto (ripetuta per ogni giorno coperto)
+            if row['day']:
+                covered_days.add(row['day'])
+            tickets.setdefault(row['id'], {
+                'id': row['id'],
+                'user_id': user_id,
+                'ticket_type': row['ticket_type'],
+                'days': row['days'],
+                'price': row['price'],
+                'purchase_date': row['purchase_date']
+            })
+    finally:
+        cursor.close()
+    
+    existing_tickets = sorted(tickets.values(), key=lambda ticket: ticket['id'])
+    has_multi_day = any(ticket['ticket_type'] in ['2days', 'full'] for ticket in existing_tickets)
+    
+    # Full pass copre automaticamente tutti i giorni
+    if any(ticket['ticket_type'] == 'full' for ticket in existing_tickets):
+        covered_days.update(availability)
+    
+    return {
+        'availability': availability,
+        'covered_days': covered_days,
+        'existing_tickets': existing_tickets,
+        'has_multi_day': has_multi_day,
+        # Stesse regole di _check_purchase_rules, precalcolate per la UI
+        'disabled_types': {
+            'daily': has_multi_day,
+            '2days': bool(existing_tickets),
+            'full': bool(existing_tickets)
+        }
+    }
+
+def check_purchase_context(context, ticket_type, selected_days):
+    """Prevalidazione su un contesto già letto. Scarta le richieste impossibili
+    senza prendere il lock di scrittura; l'esito definitivo resta di purchase_ticket."""
+    if not _days_available(context['availability'], ticket_type, selected_days):
+        return PURCHASE_SOLD_OUT, "Biglietti non disponibili per le date selezionate"
+    
+    if context['has_multi_day']:
+        return PURCHASE_RULE_VIOLATION, "Hai già un pass multi-giorno. Non puoi acquistare altri biglietti."
+    
+    if context['disabled_types'].get(ticket_type):
+        return PURCHASE_RULE_VIOLATION, "Hai già biglietti giornalieri. Non puoi acquistare un pass multi-giorno."
+    
+    for day in selected_days:
+        if day in context['covered_days']:
+            day_names = {'venerdi': 'Venerdì', 'sabato': 'Sabato', 'domenica': 'Domenica'}
+            return PURCHASE_RULE_VIOLATION, f"Hai già un biglietto per {day_names.get(day, day)}."
+    
+    return PURCHASE_SUCCESS, "OK"
+
+# Righe attese in ticket_days, derivate dal CSV tickets.days (stesso join della migrazione 002)
+_TICKET_DAYS_FROM_CSV = '''SELECT t.id, d.day
+                          FROM tickets t
+                          JOIN day_inventory d
+                            ON ',' || replace(t.days, ' ', '') || ',' LIKE '%,' || d.day || ',%'
+                       '''
+
+def rebuild_day_inventory():
+    """Rigenera ticket_days da tickets.days e poi day_inventory da ticket_days.
+    
+    Restituisce solo i giorni con differenze, nella forma
+    {giorno: {'stored': contatore, 'actual': ricalcolato,
+              'missing': righe ticket_days aggiunte, 'extra': righe ticket_days rimosse}}.
+    """
+    conn = database.get_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
         
-        return True, "OK"
+        stored = _read_inventory(cursor)
         
-    except Exception as e:
-        print(f"Errore validazione acquisto: {e}")
-        return False, "Errore durante la verifica"
+        # Confronto con il CSV: i trigger su ticket_days aggiornano day_inventory, riscritto sotto
+        cursor.execute(f'{_TICKET_DAYS_FROM_CSV} EXCEPT SELECT ticket_id, day FROM ticket_days')
+        missing = cursor.fetchall()
+        cursor.execute(f'SELECT ticket_id, day FROM ticket_days EXCEPT {_TICKET_DAYS_FROM_CSV}')
+        extra = cursor.fetchall()
+        
+        cursor.executemany('DELETE FROM ticket_days WHERE ticket_id = ? AND day = ?',
+                           [tuple(row) for row in extra])
+        cursor.executemany('INSERT INTO ticket_days (ticket_id, day) VALUES (?, ?)',
+                           [tuple(row) for row in missing])
+        
+        actual = _count_sold_by_day(cursor)
+        
+        drift = {}
+        for rows, key in ((missing, 'missing'), (extra, 'extra')):
+            for _, day in rows:
+                entry = drift.setdefault(day, {'stored': stored.get(day, 0), 'actual': actual.get(day, 0),
+                                               'missing': 0, 'extra': 0})
+                entry[key] += 1
+        for day, sold in actual.items():
+            if stored[day] != sold:
+                drift.setdefault(day, {'stored': stored[day], 'actual': sold, 'missing': 0, 'extra': 0})
+            cursor.execute('INSERT OR REPLACE INTO day_inventory (day, sold) VALUES (?, ?)', (day, sold))
+        
+        conn.commit()
+        return drift
+        
+    except sqlite3.Error:
+        conn.rollback()
+        raise
     finally:
         cursor.close()
-        conn.close()
 
 def get_user_covered_days(user_id):
     """Restituisce giorni già coperti dai biglietti utente. Per UI form acquisto."""
-    sql = 'SELECT ticket_type, days FROM tickets WHERE user_id = ?'
+    # Full pass copre automaticamente tutti i giorni, anche con CSV incompleto
+    sql = '''SELECT td.day
+             FROM tickets t
+             JOIN ticket_days td ON td.ticket_id = t.id
+             WHERE t.user_id = ?
+             UNION
+             SELECT day FROM day_inventory
+             WHERE EXISTS (SELECT 1 FROM tickets WHERE user_id = ? AND ticket_type = 'full')'''
     
-    conn = sqlite3.connect('db/festival.db')
-    conn.row_factory = sqlite3.Row
+    conn = database.get_connection()
     cursor = conn.cursor()
     
     try:
-        cursor.execute(sql, (user_id,))
-        tickets = cursor.fetchall()
-        covered_days = set()
-        
-        for ticket in tickets:
-            ticket_type, days = ticket[0], ticket[1]
-            
-            # Full pass copre automaticamente tutti i giorni
-            if ticket_type == 'full':
-                covered_days.update(['venerdi', 'sabato', 'domenica'])
-            elif ticket_type == '2days' and days:
-                covered_days.update(days.split(','))
-            elif ticket_type == 'daily' and days:
-                covered_days.update(days.split(','))
-        
-        return covered_days
+        cursor.execute(sql, (user_id, user_id))
+        return {row[0] for row in cursor.fetchall()}
         
     except Exception as e:
         print(f"Errore recupero giorni coperti: {e}")
         return set()
     finally:
         cursor.close()
-        conn.close()
 
 def get_festival_stats():
     """Genera statistiche vendite per dashboard organizzatori."""
-    conn = sqlite3.connect('db/festival.db')
+    conn = database.get_connection()
     cursor = conn.cursor()
     
     try:
@@ -222,15 +421,8 @@ def get_festival_stats():
                           GROUP BY ticket_type''')
         by_type_data = cursor.fetchall()
         
-        # Analisi partecipazione per giorno (query aggregata)
-        cursor.execute('''SELECT 
-                            SUM(CASE WHEN days LIKE '%venerdi%' THEN 1 ELSE 0 END) as venerdi,
-                            SUM(CASE WHEN days LIKE '%sabato%' THEN 1 ELSE 0 END) as sabato,
-                            SUM(CASE WHEN days LIKE '%domenica%' THEN 1 ELSE 0 END) as domenica
-                          FROM tickets 
-                          WHERE days IS NOT NULL AND days != ''
-                       ''')
-        day_stats = cursor.fetchone()
+        # Analisi partecipazione per giorno (GROUP BY sull'indice di ticket_days)
+        by_day = _count_sold_by_day(cursor)
         
         # Formattazione dati per dashboard
         by_type = {
@@ -243,12 +435,6 @@ def get_festival_stats():
             if ticket_type in by_type:
                 by_type[ticket_type] = count
         
-        by_day = {
-            'venerdi': day_stats[0] if day_stats[0] else 0,
-            'sabato': day_stats[1] if day_stats[1] else 0,
-            'domenica': day_stats[2] if day_stats[2] else 0
-        }
-        
         return {
             'total_tickets': total_tickets or 0,
             'total_revenue': f"{total_revenue:.2f}" if total_revenue else "0.00",
@@ -267,5 +453,4 @@ def get_festival_stats():
             'available_tickets': {'venerdi': 200, 'sabato': 200, 'domenica': 200}
         }
     finally:
-        cursor.close()
-        conn.close()
\ No newline at end of file
+        cursor.close()
\ No newline at end of file
@@ -1,42 +1,76 @@
 import sqlite3
 from werkzeug.security import check_password_hash
 
+import database
+from cache import LRUCache
+from models import User
+
+# Utenti di sessione per il user_loader di Flask-Login. Il TTL limita quanto a lungo
+# un processo vede un utente modificato da un altro processo
+_user_cache = LRUCache(maxsize=1024, ttl=300)
+
+def get_user_cache_stats():
+    """Hit/miss della cache degli utenti di sessione, per il monitoraggio."""
+    return _user_cache.stats()
+
+def invalidate_user(user_id):
+    _user_cache.delete(int(user_id))
+
 
 def get_user_by_email(email):
     """Recupera utente per email. Usato per login e controllo duplicati."""
     sql = 'SELECT * FROM users WHERE email = ?'
     
-    conn = sqlite3.connect('db/festival.db')
-    conn.row_factory = sqlite3.Row
+    conn = database.get_connection()
     cursor = conn.cursor()
     cursor.execute(sql, (email,))
     
     user = cursor.fetchone()
     
     cursor.close()
-    conn.close()
     return user
 
 def get_user_by_id(user_id):
     """Recupera utente per ID. Callback Flask-Login per sessioni."""
     sql = 'SELECT * FROM users WHERE id = ?'
     
-    conn = sqlite3.connect('db/festival.db')
-    conn.row_factory = sqlite3.Row
+    conn = database.get_connection()
     cursor = conn.cursor()
     cursor.execute(sql, (user_id,))
     
     user = cursor.fetchone()
     
     cursor.close()
-    conn.close()
     return user if user else None
 
+def get_session_user(user_id):
+    """User per Flask-Login, dalla cache o con le sole colonne che servono (niente hash password)."""
+    user_id = int(user_id)
+    user = _user_cache.get(user_id)
+    if user is not None:
+        return user
+    
+    sql = 'SELECT id, email, full_name, user_type FROM users WHERE id = ?'
+    
+    conn = database.get_connection()
+    cursor = conn.cursor()
+    cursor.execute(sql, (user_id,))
+    
+    row = cursor.fetchone()
+    
+    cursor.close()
+    if not row:
+        return None
+    
+    user = User(id=row['id'], email=row['email'], full_name=row['full_name'], user_type=row['user_type'])
+    _user_cache.set(user_id, user)
+    return user
+
 def add_user(user_data):
     """Registra nuovo utente. Password già hashata in input."""
     sql = "INSERT INTO users (email, password, full_name, user_type) VALUES (?, ?, ?, ?)"
     
-    conn = sqlite3.connect('db/festival.db')
+    conn = database.get_connection()
     cursor = conn.cursor()
     
     try:
@@ -49,13 +83,14 @@ def add_user(user_data):
         conn.commit()
         return True
     except sqlite3.IntegrityError:
+        conn.rollback()
         # Email duplicata (constraint UNIQUE)
         return False
     except sqlite3.Error:
+        conn.rollback()
         return False
     finally:
         cursor.close()
-        conn.close()
 
 def update_user(user_id, user_data):
     """Aggiorna profilo utente. Non modifica password per sicurezza."""
@@ -63,7 +98,7 @@ def update_user(user_id, user_data):
              SET full_name = ?, profile_image = ?
              WHERE id = ?'''
     
-    conn = sqlite3.connect('db/festival.db')
+    conn = database.get_connection()
     cursor = conn.cursor()
     
     try:
@@ -73,30 +108,32 @@ def update_user(user_id, user_data):
             user_id
         ))
         conn.commit()
+        invalidate_user(user_id)
         # rowcount > 0 = aggiornamento effettuato
         return cursor.rowcount > 0
     except sqlite3.Error:
+        conn.rollback()
         return False
     finally:
         cursor.close()
-        conn.close()
 
 def change_password(user_id, new_password_hash):
     """Cambia password utente. Hash già calcolato per sicurezza."""
     sql = 'UPDATE users SET password = ? WHERE id = ?'
     
-    conn = sqlite3.connect('db/festival.db')
+    conn = database.get_connection()
     cursor = conn.cursor()
     
     try:
         cursor.execute(sql, (new_password_hash, user_id))
         conn.commit()
+        invalidate_user(user_id)
         return cursor.rowcount > 0
     except sqlite3.Error:
+        conn.rollback()
         return False
     finally:
         cursor.close()
-        conn.close()
 
 def get_users_by_type(user_type):
     """Recupera utenti per tipo. Admin dashboard per gestione utenti."""
@@ -105,36 +142,36 @@ def get_users_by_type(user_type):
              WHERE user_type = ?
              ORDER BY full_name'''
     
-    conn = sqlite3.connect('db/festival.db')
-    conn.row_factory = sqlite3.Row
+    conn = database.get_connection()
     cursor = conn.cursor()
     cursor.execute(sql, (user_type,))
     
     users = cursor.fetchall()
     
     cursor.close()
-    conn.close()
     return users
 
 def delete_user(user_id):
     """Elimina utente se non ha dati associati (performance/biglietti)."""
     sql = 'DELETE FROM users WHERE id = ?'
     
-    conn = sqlite3.connect('db/festival.db')
+    conn = database.get_connection()
     cursor = conn.cursor()
     
     try:
         cursor.execute(sql, (user_id,))
         conn.commit()
+        invalidate_user(user_id)
         return cursor.rowcount > 0
     except sqlite3.IntegrityError:
+        conn.rollback()
         # Constraint FK violata - utente ha dati associati
         return False
     except sqlite3.Error:
+        conn.rollback()
         return False
     finally:
         cursor.close()
-        conn.close()
 
 def verify_user_credentials(email, password_hash):
     """Verifica credenziali complete per autenticazione sicura."""